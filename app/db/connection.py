@@ -1,18 +1,66 @@
-from sqlalchemy.exc import OperationalError
+import time
 from decouple import config
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, make_url, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from app.utils.metrics import Gauge, db_pool_checkout_seconds
 
 DB_URL = config('DB_URL')
+ASYNC_DB_URL = config('ASYNC_DB_URL', default=make_url(DB_URL).set(drivername="postgresql+asyncpg").render_as_string(hide_password=False))
 
-print(f"Conectando com a URL: {DB_URL}")
-engine = create_engine(DB_URL, pool_pre_ping=True)
+class TimedQueuePool(QueuePool):
+    # Mede quanto cada checkout espera por uma conexão livre (ou pela abertura
+    # de uma nova), o primeiro sinal de pool subdimensionado.
+    engine_name = "sync"
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            db_pool_checkout_seconds.observe(time.perf_counter() - start, self.engine_name)
+
+
+class TimedAsyncQueuePool(AsyncAdaptedQueuePool):
+    engine_name = "async"
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            db_pool_checkout_seconds.observe(time.perf_counter() - start, self.engine_name)
+
+
+# Os engines não abrem conexão na importação; o primeiro acesso ao banco
+# acontece em warm_up(), chamado em segundo plano pelo lifespan.
+engine = create_engine(DB_URL, pool_pre_ping=True, poolclass=TimedQueuePool)
 Session = sessionmaker(bind=engine)
 
-try:
-    with engine.connect() as connection:
-        print("Conexão bem-sucedida com o banco!")
-        result = connection.execute(text("SELECT NOW();"))
-        print(f"Hora atual no banco: {result.fetchone()}")
-except OperationalError as e:
-    print(f"Erro ao conectar no banco: {e}")
+# As rotas da API usam o engine assíncrono; o gravador de leituras, as
+# migrações e a manutenção das partições continuam no engine síncrono.
+async_engine = create_async_engine(ASYNC_DB_URL, pool_pre_ping=True, poolclass=TimedAsyncQueuePool)
+AsyncSessionFactory = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+
+Gauge(
+    "ohmni_db_pool_connections",
+    "Conexões do pool por engine e estado.",
+    lambda: {
+        (name, state): value
+        for name, pool in (("sync", engine.pool), ("async", async_engine.sync_engine.pool))
+        for state, value in (("checked_out", pool.checkedout()), ("idle", pool.checkedin()))
+    },
+    ("engine", "state"),
+)
+
+
+async def warm_up():
+    print(f"Conectando com a URL: {make_url(ASYNC_DB_URL).render_as_string(hide_password=True)}")
+    try:
+        async with async_engine.connect() as connection:
+            print("Conexão bem-sucedida com o banco!")
+            result = await connection.execute(text("SELECT NOW();"))
+            print(f"Hora atual no banco: {result.fetchone()}")
+    except Exception as e:
+        print(f"Erro ao conectar no banco: {e}")
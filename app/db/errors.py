@@ -0,0 +1,24 @@
+from sqlalchemy.exc import DBAPIError, IntegrityError, InterfaceError, OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+FOREIGN_KEY_VIOLATION = "23503"
+
+
+def is_foreign_key_violation(error: IntegrityError) -> bool:
+    # psycopg2 e asyncpg expõem o SQLSTATE em pgcode.
+    return getattr(error.orig, "pgcode", None) == FOREIGN_KEY_VIOLATION
+
+
+def integrity_detail(error: IntegrityError) -> str:
+    diag = getattr(error.orig, "diag", None)
+    if diag is not None and diag.message_detail:
+        return diag.message_detail
+    return getattr(error.orig, "detail", None) or str(error.orig)
+
+
+def is_connection_error(error: Exception) -> bool:
+    # Banco fora do ar, conexão derrubada ou pool esgotado: vale tentar de novo
+    # mais tarde, ao contrário de erros nos próprios dados.
+    if isinstance(error, (OperationalError, InterfaceError, PoolTimeoutError)):
+        return True
+    return isinstance(error, DBAPIError) and error.connection_invalidated
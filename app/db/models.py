@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey
+from sqlalchemy import Column, DateTime, Float, Index, Integer, String, Boolean, ForeignKey
 from sqlalchemy.orm import relationship
 from app.db.base import Base
 
@@ -33,13 +33,34 @@ class DeviceModel(Base):
 
     owner_user = relationship("UserModel", back_populates="devices")
     data = relationship("DeviceDataModel", back_populates="device", cascade="all, delete-orphan")
+    rollups = relationship("DeviceRollupModel", back_populates="device", cascade="all, delete-orphan")
 
 class DeviceDataModel(Base):
     __tablename__ = 'device_data'
-    id = Column(String, primary_key=True, index=True)
+    id = Column(String, primary_key=True)
     device_id = Column(String, ForeignKey('devices.id'), nullable=False)
-    corrente = Column(String, nullable=False)
-    tensao = Column(String, nullable=False)
-    timestamp = Column(String, nullable=False)
+    corrente = Column(Float, nullable=False)
+    tensao = Column(Float, nullable=False)
+    timestamp = Column(DateTime(timezone=True), primary_key=True)
 
     device = relationship("DeviceModel", back_populates="data")
+
+    __table_args__ = (
+        Index('ix_device_data_device_id_timestamp', device_id, timestamp.desc()),
+        {'postgresql_partition_by': 'RANGE ("timestamp")'},
+    )
+
+class DeviceRollupModel(Base):
+    __tablename__ = 'device_rollups'
+    device_id = Column(String, ForeignKey('devices.id'), primary_key=True)
+    resolution = Column(String, primary_key=True)
+    bucket = Column(DateTime(timezone=True), primary_key=True)
+    samples = Column(Integer, nullable=False)
+    corrente_min = Column(Float, nullable=False)
+    corrente_max = Column(Float, nullable=False)
+    corrente_sum = Column(Float, nullable=False)
+    tensao_sum = Column(Float, nullable=False)
+    potencia_sum = Column(Float, nullable=False)
+    energia_wh = Column(Float, nullable=False)
+
+    device = relationship("DeviceModel", back_populates="rollups")
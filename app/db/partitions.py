@@ -0,0 +1,124 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from decouple import config
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+PARTITION_INTERVAL = config('PARTITION_INTERVAL', default='month')
+PARTITION_PREMAKE = config('PARTITION_PREMAKE', default=3, cast=int)
+TELEMETRY_RETENTION_DAYS = config('TELEMETRY_RETENTION_DAYS', default=0, cast=int)
+PARTITION_MAINTENANCE_INTERVAL = config('PARTITION_MAINTENANCE_INTERVAL', default=3600, cast=int)
+
+PARENT_TABLE = 'device_data'
+# Chave do advisory lock da manutenção ("ohmni" em ASCII).
+PARTITION_LOCK_KEY = 0x6F686D6E69
+
+
+def floor_boundary(moment: datetime, interval: str = PARTITION_INTERVAL) -> datetime:
+    moment = moment.astimezone(timezone.utc)
+    if interval == 'day':
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if interval == 'month':
+        return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"PARTITION_INTERVAL inválido: {interval}")
+
+
+def next_boundary(moment: datetime, interval: str = PARTITION_INTERVAL) -> datetime:
+    start = floor_boundary(moment, interval)
+    if interval == 'day':
+        return start + timedelta(days=1)
+    if start.month == 12:
+        return start.replace(year=start.year + 1, month=1)
+    return start.replace(month=start.month + 1)
+
+
+def list_partitions(connection: Connection) -> list[tuple[str, datetime]]:
+    rows = connection.execute(text(f"""
+        SELECT c.relname,
+               (regexp_match(pg_get_expr(c.relpartbound, c.oid), 'TO \\(''([^'']+)''\\)'))[1]::timestamptz
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = '{PARENT_TABLE}'::regclass
+        ORDER BY 2
+    """))
+    return [(name, upper) for name, upper in rows]
+
+
+def ensure_partitions(
+    connection: Connection,
+    interval: str = PARTITION_INTERVAL,
+    premake: int = PARTITION_PREMAKE,
+    now: Optional[datetime] = None,
+) -> list[str]:
+    now = now or datetime.now(timezone.utc)
+    partitions = list_partitions(connection)
+    lower = partitions[-1][1] if partitions else floor_boundary(now, interval)
+
+    target = now
+    for _ in range(premake + 1):
+        target = next_boundary(target, interval)
+
+    created = []
+    while lower < target:
+        upper = next_boundary(lower, interval)
+        name = f"{PARENT_TABLE}_p{lower.astimezone(timezone.utc):%Y%m%d}"
+        connection.exec_driver_sql(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {PARENT_TABLE} "
+            f"FOR VALUES FROM ('{lower.isoformat()}') TO ('{upper.isoformat()}')"
+        )
+        created.append(name)
+        lower = upper
+    return created
+
+
+def drop_expired_partitions(
+    connection: Connection,
+    retention_days: int = TELEMETRY_RETENTION_DAYS,
+    now: Optional[datetime] = None,
+) -> list[str]:
+    if retention_days <= 0:
+        return []
+    cutoff = (now or datetime.now(timezone.utc)) - timedelta(days=retention_days)
+    dropped = []
+    for name, upper in list_partitions(connection):
+        if upper is None or upper > cutoff:
+            continue
+        connection.exec_driver_sql(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}")
+        connection.exec_driver_sql(f"DROP TABLE {name}")
+        dropped.append(name)
+    return dropped
+
+
+def run_partition_maintenance(engine: Engine) -> bool:
+    # Cada worker da API (e o processo 0 da ingestão) roda este ciclo; o
+    # advisory lock garante que só um deles executa o DDL de cada vez. Os
+    # outros pulam o ciclo, já que o que ele faria já está sendo feito.
+    with engine.connect() as connection:
+        locked = connection.scalar(text("SELECT pg_try_advisory_lock(:key)"), {"key": PARTITION_LOCK_KEY})
+        connection.commit()
+        if not locked:
+            return False
+        try:
+            with connection.begin():
+                created = ensure_partitions(connection)
+            if created:
+                print(f"Partições criadas: {created}")
+
+            with connection.begin():
+                dropped = drop_expired_partitions(connection)
+            if dropped:
+                print(f"Partições removidas pela retenção de {TELEMETRY_RETENTION_DAYS} dias: {dropped}")
+        finally:
+            connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": PARTITION_LOCK_KEY})
+            connection.commit()
+    return True
+
+
+async def maintain_partitions(engine: Engine):
+    while True:
+        try:
+            await asyncio.to_thread(run_partition_maintenance, engine)
+        except Exception as e:
+            print(f"Erro na manutenção das partições de device_data: {e}")
+        await asyncio.sleep(PARTITION_MAINTENANCE_INTERVAL)
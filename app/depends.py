@@ -1,9 +1,13 @@
 from fastapi import Depends
-from app.db.connection import Session
+from app.db.connection import AsyncSessionFactory, Session
 
 def get_db_session():
     try:
         db = Session()
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db_session():
+    async with AsyncSessionFactory() as db:
+        yield db
\ No newline at end of file
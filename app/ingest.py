@@ -0,0 +1,85 @@
+import asyncio
+import multiprocessing
+import signal
+from decouple import config
+from app.db.connection import engine
+from app.db.partitions import maintain_partitions
+from app.utils.ingest import ingest_writer
+from app.utils.metrics import METRICS_PORT, serve_metrics
+from app.utils.mqtt_client import SHARED_GROUP, data_topic, start_mqtt_thread, stop_mqtt
+from app.utils.partitioning import device_partition
+from app.utils.presence import watch_inactive_devices
+
+INGEST_PROCESSES = config('INGEST_PROCESSES', default=1, cast=int)
+
+
+async def serve(index: int):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    if SHARED_GROUP:
+        device_partition.share()
+    else:
+        device_partition.configure(index, INGEST_PROCESSES)
+    ingest_writer.start(f"ingest-{index}")
+    start_mqtt_thread(ingest=True)
+    tasks = [asyncio.create_task(watch_inactive_devices())]
+    if index == 0:
+        tasks.append(asyncio.create_task(maintain_partitions(engine)))
+    try:
+        await stop.wait()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.to_thread(stop_mqtt)
+        await asyncio.to_thread(ingest_writer.stop)
+
+
+def run_worker(index: int):
+    print(f"Processo de ingestão {index} de {INGEST_PROCESSES} assinando {data_topic()}")
+    # Cada processo expõe as próprias métricas em METRICS_PORT + índice.
+    metrics_server = serve_metrics(METRICS_PORT + index if METRICS_PORT else 0)
+    asyncio.run(serve(index))
+    if metrics_server is not None:
+        metrics_server.shutdown()
+    print(f"Processo de ingestão {index} finalizado")
+
+
+def main():
+    if INGEST_PROCESSES > 1 and SHARED_GROUP:
+        print(
+            f"Assinatura compartilhada {data_topic()}: o broker escolhe o processo de cada mensagem. "
+            "Use uma estratégia fixa por tópico (por exemplo, hash_topic no EMQX) para que cada "
+            "dispositivo fique sempre no mesmo processo"
+        )
+    elif INGEST_PROCESSES > 1:
+        print(f"{INGEST_PROCESSES} processos assinando {data_topic()}: cada mensagem chega a todos e só o dono do dispositivo a processa")
+    if INGEST_PROCESSES == 1:
+        run_worker(0)
+        return
+
+    # spawn: cada processo cria o próprio cliente MQTT e o próprio pool de conexões.
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=run_worker, args=(index,), name=f"ingest-{index}")
+        for index in range(INGEST_PROCESSES)
+    ]
+    for process in processes:
+        process.start()
+
+    def terminate(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGINT, terminate)
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
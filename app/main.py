@@ -1,32 +1,51 @@
 import asyncio
-import time
+from decouple import config
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.utils.mqtt_client import connection_status, connection_status_lock
+from app.db.connection import async_engine, engine, warm_up
+from app.db.partitions import maintain_partitions
+from app.utils.broadcast import broadcast_hub
+from app.utils.ingest import ingest_writer
+from app.utils.metrics import RouteMetricsMiddleware
+from app.utils.profiling import PROFILING_ENABLED, ProfilingMiddleware, install_sql_hooks
+from app.utils.mqtt_client import start_mqtt_thread, stop_mqtt
+from app.utils.presence import presence, watch_inactive_devices, write_presence_changes
+from app.utils.recent import recent_readings
 from app.routers.community_routes import community_router
 from app.routers.user_routes import user_router
 from app.routers.devices_routes import devices_router
+from app.routers.ingest_routes import ingest_router
+from app.routers.metrics_routes import metrics_router
 from contextlib import asynccontextmanager
 
+# Com INGEST_IN_API=False a API não inicia cliente MQTT nem gravador de
+# leituras; a ingestão roda à parte com python -m app.ingest.
+INGEST_IN_API = config('INGEST_IN_API', default=True, cast=bool)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    async def check_inactive_devices():
-        timeout = 15
-        while True:
-            print("Verificando dispositivos inativos...")
-            current_time = time.time()
-            with connection_status_lock:
-                for device_id, status in list(connection_status.items()):
-                    if status.get("connected") and (current_time - status.get("last_seen", 0) > timeout):
-                        connection_status[device_id]["connected"] = False
-                        print(f"Dispositivo {device_id} desconectado por inatividade.")
-            await asyncio.sleep(10)
-    task = asyncio.create_task(check_inactive_devices())
+    broadcast_hub.bind(asyncio.get_running_loop())
+    tasks = [asyncio.create_task(warm_up())]
+    if INGEST_IN_API:
+        ingest_writer.start()
+        start_mqtt_thread(ingest=True)
+        tasks.append(asyncio.create_task(watch_inactive_devices()))
+        tasks.append(asyncio.create_task(maintain_partitions(engine)))
+    else:
+        presence.tracking = False
+        recent_readings.enabled = False
+        tasks.append(asyncio.create_task(write_presence_changes()))
     try:
         yield
     finally:
-        task.cancel()
-        await task
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        broadcast_hub.bind(None)
+        await asyncio.to_thread(stop_mqtt)
+        await asyncio.to_thread(ingest_writer.stop)
+        if not INGEST_IN_API:
+            await asyncio.to_thread(presence.flush, True)
 
 app = FastAPI(
     title="Ohmni",
@@ -43,7 +62,13 @@ app.add_middleware(
     allow_methods=["*"],  # Métodos HTTP permitidos (GET, POST, PUT, etc.)
     allow_headers=["*"],  # Cabeçalhos permitidos
 )
+app.add_middleware(RouteMetricsMiddleware)
+if PROFILING_ENABLED:
+    install_sql_hooks(engine, async_engine.sync_engine)
+    app.add_middleware(ProfilingMiddleware)
 
 app.include_router(user_router)
 app.include_router(devices_router)
 app.include_router(community_router)
+app.include_router(ingest_router)
+app.include_router(metrics_router)
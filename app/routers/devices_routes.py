@@ -1,23 +1,49 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from app.depends import get_db_session
-from app.utils.device import DeviceService
+import asyncio
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.connection import AsyncSessionFactory
+from app.depends import get_async_db_session
+from app.utils.broadcast import SSE_KEEPALIVE_SECONDS, broadcast_hub, reading_frame
+from app.utils.device import DEVICE_DATA_MAX_PAGE_SIZE, DEVICE_DATA_PAGE_SIZE, DeviceService
+from app.utils.export import EXPORT_FORMAT_PATTERN, ExportService
+from app.utils.mqtt_client import start_mqtt_thread
+from app.utils.recent import RECENT_READINGS
 from app.schemas import (
     AllDeviceData,
+    BulkCommand,
+    BulkCommandResult,
+    BulkDeviceResult,
     DefaultResponse,
     Device,
     DeviceAdd,
     DeviceData,
+    DeviceRollup,
     Devices,
+    RecentDeviceData,
     HTTPErrorRequest,
 )
 
 devices_router = APIRouter(prefix="/devices", tags=["Devices"])
 
 
-def get_device_service(db: Session = Depends(get_db_session)) -> DeviceService:
+async def get_device_service(db: AsyncSession = Depends(get_async_db_session)) -> DeviceService:
     return DeviceService(db=db)
 
+def get_export_service() -> ExportService:
+    # A exportação abre a própria sessão com cursor no servidor ao começar a
+    # transmitir; uma sessão da dependência ficaria parada durante o stream.
+    return ExportService()
+
+async def resolve_live_devices(device_ids: Optional[list[str]], community_id: Optional[int]) -> list[str]:
+    # Exportações e assinaturas ao vivo duram muito; a sessão é fechada logo
+    # após a consulta para não prender uma conexão do pool durante todo o
+    # stream (a de get_device_service só fecharia depois do corpo enviado).
+    async with AsyncSessionFactory() as db:
+        return await DeviceService(db=db).resolve_devices(device_ids, community_id)
+
 @devices_router.get(
     "/",
     response_model=Devices,
@@ -26,22 +52,119 @@ def get_device_service(db: Session = Depends(get_db_session)) -> DeviceService:
         500: {"description": "Erro interno do servidor", "model": HTTPErrorRequest},
     },
 )
-def get_devices(device_service: DeviceService = Depends(get_device_service)) -> Devices:
-    return device_service.get_all_devices()
+async def get_devices(device_service: DeviceService = Depends(get_device_service)) -> Devices:
+    return await device_service.get_all_devices()
+
+@devices_router.get(
+    "/export",
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse,
+    responses={
+        400: {"description": "Parâmetros de exportação inválidos", "model": HTTPErrorRequest},
+        404: {"description": "Dispositivo ou comunidade sem dispositivos", "model": HTTPErrorRequest},
+    },
+)
+async def export_devices_data(
+    device_id: Optional[list[str]] = Query(None, description="Dispositivos a exportar (pode ser repetido)"),
+    community_id: Optional[int] = Query(None, description="Exporta todos os dispositivos da comunidade"),
+    export_format: str = Query("ndjson", alias="format", pattern=EXPORT_FORMAT_PATTERN, description="Formato do arquivo"),
+    start: Optional[datetime] = Query(None, description="Início do intervalo (inclusivo)"),
+    end: Optional[datetime] = Query(None, description="Fim do intervalo (exclusivo)"),
+    export_service: ExportService = Depends(get_export_service),
+) -> StreamingResponse:
+    device_ids = await resolve_live_devices(device_id, community_id)
+    return export_service.export(device_ids, export_format, start, end)
+
+@devices_router.get(
+    "/stream",
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse,
+    responses={
+        400: {"description": "Nenhum dispositivo ou comunidade informado", "model": HTTPErrorRequest},
+        404: {"description": "Dispositivo ou comunidade sem dispositivos", "model": HTTPErrorRequest},
+    },
+)
+async def stream_devices_data(
+    device_id: Optional[list[str]] = Query(None, description="Dispositivos a acompanhar (pode ser repetido)"),
+    community_id: Optional[int] = Query(None, description="Acompanha todos os dispositivos da comunidade"),
+) -> StreamingResponse:
+    device_ids = await resolve_live_devices(device_id, community_id)
+
+    start_mqtt_thread()
+
+    async def events():
+        subscription = broadcast_hub.subscribe(device_ids)
+        try:
+            while True:
+                try:
+                    readings = await asyncio.wait_for(subscription.next_batch(), SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                for reading in readings:
+                    yield f"event: reading\ndata: {reading_frame(reading)}\n\n"
+        finally:
+            broadcast_hub.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@devices_router.websocket("/ws")
+async def websocket_devices_data(
+    websocket: WebSocket,
+    device_id: Optional[list[str]] = Query(None),
+    community_id: Optional[int] = Query(None),
+):
+    try:
+        device_ids = await resolve_live_devices(device_id, community_id)
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=e.detail)
+        return
+
+    await websocket.accept()
+    start_mqtt_thread()
+    subscription = broadcast_hub.subscribe(device_ids)
+
+    async def send_readings():
+        while True:
+            for reading in await subscription.next_batch():
+                await websocket.send_text(reading_frame(reading))
+
+    async def wait_disconnect():
+        while True:
+            await websocket.receive_text()
+
+    tasks = [asyncio.create_task(send_readings()), asyncio.create_task(wait_disconnect())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        broadcast_hub.unsubscribe(subscription)
 
 @devices_router.get(
     "/{device_id}",
     response_model=AllDeviceData,
     status_code=status.HTTP_200_OK,
     responses={
+        400: {"description": "Cursor inválido", "model": HTTPErrorRequest},
         404: {"description": "Dispositivo não encontrado", "model": HTTPErrorRequest},
         500: {"description": "Erro interno do servidor", "model": HTTPErrorRequest},
     },
 )
-def get_device_data(
-    device_id: str, device_service: DeviceService = Depends(get_device_service)
+async def get_device_data(
+    device_id: str,
+    start: Optional[datetime] = Query(None, description="Início do intervalo (inclusivo)"),
+    end: Optional[datetime] = Query(None, description="Fim do intervalo (exclusivo)"),
+    limit: int = Query(DEVICE_DATA_PAGE_SIZE, ge=1, le=DEVICE_DATA_MAX_PAGE_SIZE, description="Quantidade máxima de leituras na página"),
+    cursor: Optional[str] = Query(None, description="Cursor retornado em next_cursor pela página anterior"),
+    device_service: DeviceService = Depends(get_device_service),
 ) -> AllDeviceData:
-    return device_service.get_device_data(device_id)
+    return await device_service.get_device_data(device_id, start, end, limit, cursor)
 
 @devices_router.get(
     "/{device_id}/latest",
@@ -55,10 +178,63 @@ def get_device_data(
         500: {"description": "Erro interno do servidor", "model": HTTPErrorRequest},
     },
 )
-def get_latest_device_data(
+async def get_latest_device_data(
     device_id: str, device_service: DeviceService = Depends(get_device_service)
 ) -> DeviceData:
-    return device_service.get_latest_data(device_id)
+    return await device_service.get_latest_data(device_id)
+
+@devices_router.get(
+    "/{device_id}/recent",
+    response_model=RecentDeviceData,
+    status_code=status.HTTP_200_OK,
+    responses={
+        404: {"description": "Dispositivo não encontrado", "model": HTTPErrorRequest},
+        500: {"description": "Erro interno do servidor", "model": HTTPErrorRequest},
+    },
+)
+async def get_recent_device_data(
+    device_id: str,
+    n: int = Query(10, ge=1, le=RECENT_READINGS, description="Quantidade de leituras mais recentes"),
+    device_service: DeviceService = Depends(get_device_service),
+) -> RecentDeviceData:
+    return await device_service.get_recent_data(device_id, n)
+
+@devices_router.get(
+    "/{device_id}/export",
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse,
+    responses={
+        400: {"description": "Formato de exportação inválido", "model": HTTPErrorRequest},
+        404: {"description": "Dispositivo não encontrado", "model": HTTPErrorRequest},
+    },
+)
+async def export_device_data(
+    device_id: str,
+    export_format: str = Query("ndjson", alias="format", pattern=EXPORT_FORMAT_PATTERN, description="Formato do arquivo"),
+    start: Optional[datetime] = Query(None, description="Início do intervalo (inclusivo)"),
+    end: Optional[datetime] = Query(None, description="Fim do intervalo (exclusivo)"),
+    export_service: ExportService = Depends(get_export_service),
+) -> StreamingResponse:
+    device_ids = await resolve_live_devices([device_id], None)
+    return export_service.export(device_ids, export_format, start, end)
+
+@devices_router.get(
+    "/{device_id}/rollup",
+    response_model=DeviceRollup,
+    status_code=status.HTTP_200_OK,
+    responses={
+        404: {"description": "Dispositivo não encontrado", "model": HTTPErrorRequest},
+        500: {"description": "Erro interno do servidor", "model": HTTPErrorRequest},
+    },
+)
+async def get_device_rollup(
+    device_id: str,
+    resolution: str = Query("1h", pattern="^(1m|1h|1d)$", description="Resolução dos agregados: 1m, 1h ou 1d"),
+    start: Optional[datetime] = Query(None, description="Início do intervalo (inclusivo)"),
+    end: Optional[datetime] = Query(None, description="Fim do intervalo (exclusivo)"),
+    device_service: DeviceService = Depends(get_device_service),
+) -> DeviceRollup:
+    return await device_service.get_rollup(device_id, resolution, start, end)
 
 @devices_router.post(
     "/",
@@ -69,10 +245,40 @@ def get_latest_device_data(
         500: {"description": "Erro interno do servidor", "model": HTTPErrorRequest},
     },
 )
-def add_device(
+async def add_device(
     device: DeviceAdd, device_service: DeviceService = Depends(get_device_service)
 ) -> DefaultResponse:
-    return device_service.add_device(device)
+    return await device_service.add_device(device)
+
+@devices_router.post(
+    "/bulk",
+    response_model=BulkDeviceResult,
+    status_code=status.HTTP_200_OK,
+    responses={
+        500: {"description": "Erro interno do servidor", "model": HTTPErrorRequest},
+    },
+)
+async def add_devices(
+    devices: list[DeviceAdd], device_service: DeviceService = Depends(get_device_service)
+) -> BulkDeviceResult:
+    return await device_service.add_devices(devices)
+
+@devices_router.post(
+    "/commands",
+    response_model=BulkCommandResult,
+    status_code=status.HTTP_200_OK,
+    responses={
+        400: {"description": "Nenhum dispositivo ou comunidade informado", "model": HTTPErrorRequest},
+        404: {"description": "Dispositivo ou comunidade sem dispositivos", "model": HTTPErrorRequest},
+        422: {"description": "Timeout ou quantidade de dispositivos acima do limite", "model": HTTPErrorRequest},
+    },
+)
+async def send_bulk_command(
+    bulk_command: BulkCommand, device_service: DeviceService = Depends(get_device_service)
+) -> BulkCommandResult:
+    return await device_service.send_bulk_command(
+        bulk_command.command, bulk_command.device_ids, bulk_command.community_id, bulk_command.timeout
+    )
 
 @devices_router.post(
     "/{device_id}/connect",
@@ -118,8 +324,8 @@ async def disconnect_device(
         500: {"description": "Erro interno do servidor", "model": HTTPErrorRequest},
     },
 )
-def delete_device(
+async def delete_device(
     device_id: str, device_service: DeviceService = Depends(get_device_service)
 ) -> DefaultResponse:
-    return device_service.delete_device(device_id)
+    return await device_service.delete_device(device_id)
 
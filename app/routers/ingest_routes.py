@@ -0,0 +1,12 @@
+from fastapi import APIRouter, status
+from app.schemas import IngestStatus
+from app.utils.ingest import ingest_writer
+
+
+ingest_router = APIRouter(prefix="/ingest", tags=["Ingest"])
+
+@ingest_router.get("/status", response_model=IngestStatus, status_code=status.HTTP_200_OK)
+async def get_ingest_status() -> IngestStatus:
+    # Estado da fila deste processo; com INGEST_IN_API=False o gravador roda em
+    # python -m app.ingest e aqui aparece parado.
+    return IngestStatus(**ingest_writer.status())
@@ -1,4 +1,6 @@
+import math
 import re
+from datetime import datetime
 from typing import Optional
 from pydantic import BaseModel, field_validator
 
@@ -169,6 +171,18 @@ class DeviceAdd(BaseModel):
             raise ValueError('is_collective must be a boolean')
         return v
     
+class BulkDeviceItem(BaseModel):
+    id: str
+    status: str
+    detail: Optional[str] = None
+
+class BulkDeviceResult(BaseModel):
+    results: list[BulkDeviceItem]
+    total: int
+    created: int
+    conflicts: int
+    failed: int
+
 class DeviceData(BaseModel):
     id: str
     device_id: str
@@ -203,7 +217,7 @@ class DeviceData(BaseModel):
 class DeviceDataSearch(BaseModel):
     corrente: float
     tensao: float
-    timestamp: str
+    timestamp: datetime
 
 class AllDeviceData(BaseModel):
     device_id: str
@@ -214,6 +228,7 @@ class AllDeviceData(BaseModel):
     is_collective: bool
     data: list[DeviceDataSearch]
     total: int
+    next_cursor: Optional[str] = None
 
     @field_validator('device_id')
     def device_id_must_be_valid(cls, v):
@@ -263,6 +278,87 @@ class AllDeviceData(BaseModel):
             raise ValueError('total must be an integer')
         return v
 
+class RecentDeviceData(BaseModel):
+    device_id: str
+    connected: bool
+    data: list[DeviceDataSearch]
+    total: int
+
+class RollupBucket(BaseModel):
+    bucket: datetime
+    samples: int
+    corrente_min: float
+    corrente_max: float
+    corrente_avg: float
+    tensao_avg: float
+    potencia_avg: float
+    energia_wh: float
+
+class DeviceRollup(BaseModel):
+    device_id: str
+    resolution: str
+    buckets: list[RollupBucket]
+    total: int
+
+    @field_validator('resolution')
+    def resolution_must_be_valid(cls, v):
+        if v not in ('1m', '1h', '1d'):
+            raise ValueError('resolution must be one of 1m, 1h, 1d')
+        return v
+
+class BulkCommand(BaseModel):
+    command: str
+    device_ids: Optional[list[str]] = None
+    community_id: Optional[int] = None
+    timeout: Optional[float] = None
+
+    @field_validator('command')
+    def command_must_be_valid(cls, v):
+        if v not in ('connect', 'disconnect'):
+            raise ValueError('command must be connect or disconnect')
+        return v
+
+    @field_validator('timeout')
+    def timeout_must_be_valid(cls, v):
+        if v is not None and v <= 0:
+            raise ValueError('timeout must be positive')
+        return v
+
+class BulkCommandItem(BaseModel):
+    device_id: str
+    status: str
+    response: Optional[str] = None
+    detail: Optional[str] = None
+
+class BulkCommandResult(BaseModel):
+    command: str
+    results: list[BulkCommandItem]
+    total: int
+    acknowledged: int
+    sent: int
+    timed_out: int
+    failed: int
+    elapsed: float
+
+class SpoolStatus(BaseModel):
+    directory: Optional[str] = None
+    segments: int
+    pending_bytes: int
+    oldest_age_seconds: Optional[float] = None
+    spooled: int
+    replayed: int
+    discarded_bytes: int
+
+class IngestStatus(BaseModel):
+    running: bool
+    policy: str
+    capacity: int
+    depth: int
+    high_watermark: int
+    dropped: int
+    blocked: int
+    spool: SpoolStatus
+
 class DefaultResponse(BaseModel):
     msg: str
 
@@ -300,4 +396,16 @@ class LoginResponse(BaseModel):
 class MqttPayload(BaseModel):
     id: str
     corrente: float
-    tensao: float
\ No newline at end of file
+    tensao: float
+
+    @field_validator('corrente', 'tensao', mode='before')
+    def reading_must_not_be_bool(cls, v):
+        if isinstance(v, bool):
+            raise ValueError('reading must be a number')
+        return v
+
+    @field_validator('corrente', 'tensao')
+    def reading_must_be_finite(cls, v):
+        if not math.isfinite(v):
+            raise ValueError('reading must be finite')
+        return v
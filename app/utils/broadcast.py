@@ -0,0 +1,105 @@
+import asyncio
+import json
+import threading
+from typing import Callable, Dict, Iterable, List, Optional
+from decouple import config
+
+SSE_KEEPALIVE_SECONDS = config('SSE_KEEPALIVE_SECONDS', default=15, cast=int)
+
+
+def reading_frame(reading: Dict) -> str:
+    return json.dumps({
+        "id": reading["id"],
+        "device_id": reading["device_id"],
+        "corrente": reading["corrente"],
+        "tensao": reading["tensao"],
+        "timestamp": reading["timestamp"].isoformat(),
+    })
+
+
+class Subscription:
+    def __init__(self, device_ids: Iterable[str]):
+        self.device_ids = set(device_ids)
+        self.coalesced = 0
+        self._pending: Dict[str, Dict] = {}
+        self._event = asyncio.Event()
+
+    def offer(self, reading: Dict):
+        # Um cliente lento nunca atrasa a ingestão: se ainda há leitura pendente
+        # para o dispositivo, ela é substituída pela mais nova.
+        if reading["device_id"] in self._pending:
+            self.coalesced += 1
+        self._pending[reading["device_id"]] = reading
+        self._event.set()
+
+    async def next_batch(self) -> List[Dict]:
+        await self._event.wait()
+        self._event.clear()
+        pending, self._pending = self._pending, {}
+        return sorted(pending.values(), key=lambda r: r["timestamp"])
+
+
+class BroadcastHub:
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._by_device: Dict[str, set] = {}
+        self._lock = threading.Lock()
+        # Avisado com (adicionados, removidos) quando um dispositivo ganha o
+        # primeiro assinante ou perde o último.
+        self._listener: Optional[Callable[[List[str], List[str]], None]] = None
+
+    def bind(self, loop: Optional[asyncio.AbstractEventLoop]):
+        self._loop = loop
+
+    def watch(self, listener: Optional[Callable[[List[str], List[str]], None]]):
+        self._listener = listener
+
+    def has_subscribers(self, device_id: str) -> bool:
+        return bool(self._by_device.get(device_id))
+
+    def devices(self) -> List[str]:
+        with self._lock:
+            return list(self._by_device)
+
+    def publish(self, reading: Dict):
+        loop = self._loop
+        if loop is None or not self._by_device.get(reading["device_id"]):
+            return
+        try:
+            loop.call_soon_threadsafe(self._dispatch, reading)
+        except RuntimeError:
+            pass
+
+    def _dispatch(self, reading: Dict):
+        for subscription in tuple(self._by_device.get(reading["device_id"], ())):
+            subscription.offer(reading)
+
+    def subscribe(self, device_ids: Iterable[str]) -> Subscription:
+        subscription = Subscription(device_ids)
+        added = []
+        with self._lock:
+            for device_id in subscription.device_ids:
+                if device_id not in self._by_device:
+                    self._by_device[device_id] = set()
+                    added.append(device_id)
+                self._by_device[device_id].add(subscription)
+        if added and self._listener is not None:
+            self._listener(added, [])
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        removed = []
+        with self._lock:
+            for device_id in subscription.device_ids:
+                subscribers = self._by_device.get(device_id)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._by_device[device_id]
+                    removed.append(device_id)
+        if removed and self._listener is not None:
+            self._listener([], removed)
+
+
+broadcast_hub = BroadcastHub()
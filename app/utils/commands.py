@@ -0,0 +1,113 @@
+import asyncio
+import threading
+import uuid
+from typing import Callable, Dict, Optional, Set, Tuple
+import paho.mqtt.client as mqtt
+from decouple import config
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+COMMAND_TIMEOUT = config('COMMAND_TIMEOUT', default=10, cast=float)
+# Limites de POST /devices/commands: cada alvo prende um future até o prazo.
+COMMAND_MAX_TIMEOUT = config('COMMAND_MAX_TIMEOUT', default=60, cast=float)
+COMMAND_BULK_MAX_DEVICES = config('COMMAND_BULK_MAX_DEVICES', default=1000, cast=int)
+COMMAND_RESPONSE_TOPIC = config('COMMAND_RESPONSE_TOPIC', default=f"ohmni/api/{uuid.uuid4().hex}/responses")
+
+
+COMMANDS = ("connect", "disconnect")
+
+
+def command_topic(device_id: str) -> str:
+    return f"iot/{device_id}/connect"
+
+
+def is_command_message(msg) -> bool:
+    # O tópico de comando é compartilhado: além das respostas dos dispositivos
+    # chegam os comandos publicados por outros processos da API (o noLocal só
+    # filtra os do próprio cliente). Comandos com correlation data trazem
+    # ResponseTopic; os demais são reconhecidos pelo payload.
+    if getattr(msg.properties, "ResponseTopic", None) is not None:
+        return True
+    return msg.payload.decode(errors="replace").strip() in COMMANDS
+
+
+class CommandBus:
+    def __init__(self, response_topic: str = COMMAND_RESPONSE_TOPIC):
+        self.response_topic = response_topic
+        self.client: Optional[mqtt.Client] = None
+        self._start: Optional[Callable[[], None]] = None
+        self._lock = threading.Lock()
+        self._pending: Dict[bytes, Tuple[str, str, asyncio.Future]] = {}
+        self._by_device: Dict[str, Set[bytes]] = {}
+
+    def attach(self, client: mqtt.Client, start: Optional[Callable[[], None]] = None):
+        self.client = client
+        self._start = start
+
+    def publish(self, device_id: str, command: str, correlation: Optional[bytes] = None):
+        properties = None
+        if correlation is not None:
+            properties = Properties(PacketTypes.PUBLISH)
+            properties.ResponseTopic = self.response_topic
+            properties.CorrelationData = correlation
+        if self._start is not None:
+            self._start()
+        # O publish do paho só enfileira o pacote para a thread de rede; sem
+        # conexão (MQTT_ERR_NO_CONN) ele fica na fila e sai ao conectar.
+        result = self.client.publish(command_topic(device_id), command, qos=1, properties=properties)
+        if result.rc not in (mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_NO_CONN):
+            raise Exception(f"Erro ao publicar mensagem MQTT: Código {result.rc}")
+
+    async def request(self, device_id: str, command: str, timeout: float = COMMAND_TIMEOUT) -> str:
+        future = asyncio.get_running_loop().create_future()
+        correlation = uuid.uuid4().bytes
+        with self._lock:
+            self._pending[correlation] = (device_id, command, future)
+            self._by_device.setdefault(device_id, set()).add(correlation)
+        try:
+            self.publish(device_id, command, correlation)
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            with self._lock:
+                self._pending.pop(correlation, None)
+                correlations = self._by_device.get(device_id)
+                if correlations is not None:
+                    correlations.discard(correlation)
+                    if not correlations:
+                        del self._by_device[device_id]
+
+    def handle_response(self, msg) -> Optional[str]:
+        correlation = getattr(msg.properties, "CorrelationData", None)
+        with self._lock:
+            entry = self._pending.get(correlation)
+        if entry is None:
+            return None
+        device_id, _, future = entry
+        self._resolve(future, msg.payload.decode().strip())
+        return device_id
+
+    def handle_legacy_reply(self, device_id: str, payload: str):
+        # Dispositivos sem MQTT v5 respondem no próprio tópico de comando e sem
+        # correlation data; a resposta vale para todo connect pendente deles.
+        with self._lock:
+            futures = [
+                self._pending[correlation][2]
+                for correlation in self._by_device.get(device_id, ())
+                if self._pending[correlation][1] == "connect"
+            ]
+        for future in futures:
+            self._resolve(future, payload)
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, payload: str):
+        def set_result():
+            if not future.done():
+                future.set_result(payload)
+
+        try:
+            future.get_loop().call_soon_threadsafe(set_result)
+        except RuntimeError:
+            pass
+
+
+command_bus = CommandBus()
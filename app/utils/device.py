@@ -1,25 +1,74 @@
 import asyncio
+import base64
+import time
+from datetime import datetime
+from typing import Optional
+from decouple import config
 from fastapi import HTTPException, status
-from app.db.models import DeviceDataModel, DeviceModel
-from app.utils.mqtt_client import publish_disconnect_message, send_connect_message, update_connection_status
-from app.schemas import AllDeviceData, DefaultResponse, Device, DeviceData, Devices
+from sqlalchemy import delete, select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from app.db.errors import integrity_detail, is_foreign_key_violation
+from app.db.models import DeviceDataModel, DeviceModel, DeviceRollupModel, UserModel
+from app.utils.commands import COMMAND_BULK_MAX_DEVICES, COMMAND_MAX_TIMEOUT, COMMAND_TIMEOUT, command_bus
+from app.utils.presence import presence
+from app.utils.recent import recent_readings
+from app.schemas import AllDeviceData, BulkCommandResult, BulkDeviceResult, DefaultResponse, Device, DeviceAdd, DeviceData, DeviceRollup, Devices, RecentDeviceData
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
-from psycopg2.errors import ForeignKeyViolation
+from sqlalchemy.ext.asyncio import AsyncSession
+
+DEVICE_DATA_PAGE_SIZE = config('DEVICE_DATA_PAGE_SIZE', default=1000, cast=int)
+DEVICE_DATA_MAX_PAGE_SIZE = config('DEVICE_DATA_MAX_PAGE_SIZE', default=10000, cast=int)
+DEVICE_BULK_CHUNK_SIZE = config('DEVICE_BULK_CHUNK_SIZE', default=1000, cast=int)
+
+
+def encode_cursor(timestamp: datetime, reading_id: str) -> str:
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{reading_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, str]:
+    try:
+        timestamp, reading_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(timestamp), reading_id
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cursor inválido")
+
 
 class DeviceService:
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
 
-    def get_all_devices(self) -> Devices:
-        devices = self.db.query(DeviceModel).all()
+    async def get_all_devices(self) -> Devices:
+        devices = (await self.db.scalars(select(DeviceModel))).all()
         return {
-            "devices": [{"device_id": d.id, "connected": d.connected} for d in devices] if devices else [],
+            "devices": [{"device_id": d.id, "connected": presence.is_connected(d.id, d.connected)} for d in devices] if devices else [],
             "total": len(devices),
         }
     
-    def add_device(self, device: Device) -> Device:
-        existing_device = self.db.query(DeviceModel).filter(DeviceModel.id == device.id).first()
+    async def resolve_devices(self, device_ids: Optional[list[str]] = None, community_id: Optional[int] = None) -> list[str]:
+        query = select(DeviceModel.id)
+        if community_id is not None:
+            query = query.join(UserModel, DeviceModel.owner == UserModel.id).where(UserModel.community_id == community_id)
+        if device_ids:
+            query = query.where(DeviceModel.id.in_(device_ids))
+        elif community_id is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Informe ao menos um device_id ou um community_id",
+            )
+
+        found = list(await self.db.scalars(query.order_by(DeviceModel.id)))
+        missing = set(device_ids or []) - set(found)
+        if missing:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Dispositivos não encontrados: {', '.join(sorted(missing))}",
+            )
+        if not found:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Nenhum dispositivo encontrado para a comunidade")
+        return found
+
+    async def add_device(self, device: Device) -> Device:
+        existing_device = await self.db.get(DeviceModel, device.id)
         if existing_device:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -33,21 +82,22 @@ class DeviceService:
             type=device.type,
             is_collective=device.is_collective,
             connected=False,
-            last_seen=0,
+            last_seen="0",
         )
         try:
             self.db.add(db_device)
-            self.db.commit()
-            self.db.refresh(db_device)
+            await self.db.commit()
+            await self.db.refresh(db_device)
+            presence.set_device_type(device.id, device.type)
             print(f"Dispositivo {device.id} adicionado com sucesso.")
         except IntegrityError as e:
-            self.db.rollback()
+            await self.db.rollback()
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=e.orig.diag.message_detail
+                detail=integrity_detail(e)
             )
         except Exception as e:
-            self.db.rollback()
+            await self.db.rollback()
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Erro ao adicionar dispositivo: {str(e)}"
@@ -55,16 +105,104 @@ class DeviceService:
 
         return DefaultResponse(msg="Dispositivo adicionado com sucesso")
 
+    async def add_devices(self, devices: list[DeviceAdd]) -> BulkDeviceResult:
+        # Donos inexistentes derrubariam o INSERT inteiro pela chave estrangeira,
+        # então são filtrados antes; id ou nome repetido vira conflito no ON CONFLICT.
+        # Um id repetido no próprio lote só vai ao INSERT na primeira ocorrência.
+        repeated = set()
+        seen_ids = set()
+        for index, device in enumerate(devices):
+            if device.id in seen_ids:
+                repeated.add(index)
+            seen_ids.add(device.id)
+        owners = {device.owner for device in devices}
+        known_owners = set(await self.db.scalars(select(UserModel.id).where(UserModel.id.in_(owners)))) if owners else set()
+        rows = [
+            {
+                "id": device.id,
+                "name": device.name,
+                "owner": device.owner,
+                "type": device.type,
+                "is_collective": device.is_collective,
+                "connected": False,
+                "last_seen": "0",
+            }
+            for index, device in enumerate(devices)
+            if device.owner in known_owners and index not in repeated
+        ]
+
+        inserted = set()
+        try:
+            for start in range(0, len(rows), DEVICE_BULK_CHUNK_SIZE):
+                result = await self.db.execute(
+                    insert(DeviceModel)
+                    .values(rows[start:start + DEVICE_BULK_CHUNK_SIZE])
+                    .on_conflict_do_nothing()
+                    .returning(DeviceModel.id, DeviceModel.name)
+                )
+                inserted.update(result.tuples())
+            await self.db.commit()
+        except Exception as e:
+            await self.db.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Erro ao adicionar dispositivos: {str(e)}"
+            )
+
+        results = []
+        for index, device in enumerate(devices):
+            if device.owner not in known_owners:
+                results.append({"id": device.id, "status": "error", "detail": f"Usuário {device.owner} não encontrado"})
+            elif index in repeated:
+                results.append({"id": device.id, "status": "conflict", "detail": "Id repetido no lote"})
+            elif (device.id, device.name) in inserted:
+                presence.set_device_type(device.id, device.type)
+                results.append({"id": device.id, "status": "created"})
+            else:
+                results.append({"id": device.id, "status": "conflict", "detail": "Já existe dispositivo com o mesmo id ou nome"})
+
+        statuses = [r["status"] for r in results]
+        print(f"{statuses.count('created')} de {len(devices)} dispositivos adicionados em lote.")
+        return {
+            "results": results,
+            "total": len(results),
+            "created": statuses.count("created"),
+            "conflicts": statuses.count("conflict"),
+            "failed": statuses.count("error"),
+        }
+
     
-    def get_device_data(self, device_id: str) -> AllDeviceData:
-        device = self.db.query(DeviceModel).filter(DeviceModel.id == device_id).first()
+    async def get_device_data(
+        self,
+        device_id: str,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        limit: int = DEVICE_DATA_PAGE_SIZE,
+        cursor: Optional[str] = None,
+    ) -> AllDeviceData:
+        device = await self.db.get(DeviceModel, device_id)
         if not device:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Dispositivo não encontrado")
-        
+
         try:
-            data = self.db.query(DeviceDataModel).filter(DeviceDataModel.device_id == device_id).all()
+            query = select(
+                DeviceDataModel.id, DeviceDataModel.corrente, DeviceDataModel.tensao, DeviceDataModel.timestamp
+            ).where(DeviceDataModel.device_id == device_id)
+            if start is not None:
+                query = query.where(DeviceDataModel.timestamp >= start)
+            if end is not None:
+                query = query.where(DeviceDataModel.timestamp < end)
+            if cursor is not None:
+                last_timestamp, last_id = decode_cursor(cursor)
+                query = query.where(
+                    DeviceDataModel.timestamp >= last_timestamp,
+                    tuple_(DeviceDataModel.timestamp, DeviceDataModel.id) > tuple_(last_timestamp, last_id),
+                )
+            data = (await self.db.execute(
+                query.order_by(DeviceDataModel.timestamp, DeviceDataModel.id).limit(limit + 1)
+            )).all()
         except IntegrityError as e:
-            if isinstance(e.orig, ForeignKeyViolation):
+            if is_foreign_key_violation(e):
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="Erro de chave estrangeira ao buscar dados do dispositivo"
@@ -74,53 +212,126 @@ class DeviceService:
                 detail="Erro ao buscar dados do dispositivo"
             )
 
-        if not data:
+        if not data and cursor is None:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Sem dados disponíveis para o dispositivo")
-        
+
+        next_cursor = None
+        if len(data) > limit:
+            data = data[:limit]
+            next_cursor = encode_cursor(data[-1].timestamp, data[-1].id)
+
         return {
             "device_id": device_id,
-            "connected": device.connected,
+            "connected": presence.is_connected(device_id, device.connected),
             "name": device.name,
             "owner": device.owner,
             "type": device.type,
             "is_collective": device.is_collective,
             "data": [{"corrente": d.corrente, "tensao": d.tensao, "timestamp": d.timestamp} for d in data],
             "total": len(data),
+            "next_cursor": next_cursor,
         }
-    
-    def get_latest_data(self, device_id: str) -> DeviceData:
-        device = self.db.query(DeviceModel).filter(DeviceModel.id == device_id).first()
+
+    async def _recent_readings(self, device_id: str, n: int) -> tuple[list[dict], bool]:
+        readings = recent_readings.get(device_id, n)
+        if readings is not None:
+            return readings, recent_readings.stored_connected(device_id)
+
+        device = await self.db.get(DeviceModel, device_id)
         if not device:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Dispositivo não encontrado")
-        
-        latest_data = (
-            self.db.query(DeviceDataModel)
-            .filter(DeviceDataModel.device_id == device_id)
+
+        stored = (await self.db.execute(
+            select(
+                DeviceDataModel.id,
+                DeviceDataModel.device_id,
+                DeviceDataModel.corrente,
+                DeviceDataModel.tensao,
+                DeviceDataModel.timestamp,
+            )
+            .where(DeviceDataModel.device_id == device_id)
             .order_by(DeviceDataModel.timestamp.desc())
-            .first()
-        )
-        if not latest_data:
+            .limit(recent_readings.size if recent_readings.enabled else n)
+        )).all()
+        if not recent_readings.enabled:
+            return [row._asdict() for row in stored], device.connected
+        recent_readings.warm(device_id, [row._asdict() for row in stored], device.connected)
+        return recent_readings.get(device_id, n), device.connected
+
+    async def get_latest_data(self, device_id: str) -> DeviceData:
+        readings, stored_connected = await self._recent_readings(device_id, 1)
+        if not readings:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Sem dados recentes para o dispositivo")
-        
+
+        latest_data = readings[0]
         return {
-            "id": latest_data.id,
+            "id": latest_data["id"],
             "device_id": device_id,
-            "connected": device.connected,
-            "corrente": latest_data.corrente,
-            "tensao": latest_data.tensao,
-            "timestamp": latest_data.timestamp,
+            "connected": presence.is_connected(device_id, stored_connected),
+            "corrente": latest_data["corrente"],
+            "tensao": latest_data["tensao"],
+            "timestamp": latest_data["timestamp"],
         }
-    
 
-    def delete_device(self, device_id: str) -> DefaultResponse:
-        device = self.db.query(DeviceModel).filter(DeviceModel.id == device_id).first()
+    async def get_recent_data(self, device_id: str, n: int) -> RecentDeviceData:
+        readings, stored_connected = await self._recent_readings(device_id, n)
+        return {
+            "device_id": device_id,
+            "connected": presence.is_connected(device_id, stored_connected),
+            "data": [{"corrente": r["corrente"], "tensao": r["tensao"], "timestamp": r["timestamp"]} for r in readings],
+            "total": len(readings),
+        }
+
+    async def get_rollup(
+        self, device_id: str, resolution: str, start: Optional[datetime] = None, end: Optional[datetime] = None
+    ) -> DeviceRollup:
+        device = await self.db.get(DeviceModel, device_id)
+        if not device:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Dispositivo não encontrado")
+
+        query = select(DeviceRollupModel).where(
+            DeviceRollupModel.device_id == device_id,
+            DeviceRollupModel.resolution == resolution,
+        )
+        if start is not None:
+            query = query.where(DeviceRollupModel.bucket >= start)
+        if end is not None:
+            query = query.where(DeviceRollupModel.bucket < end)
+        rollups = (await self.db.scalars(query.order_by(DeviceRollupModel.bucket))).all()
+
+        return {
+            "device_id": device_id,
+            "resolution": resolution,
+            "buckets": [
+                {
+                    "bucket": r.bucket,
+                    "samples": r.samples,
+                    "corrente_min": r.corrente_min,
+                    "corrente_max": r.corrente_max,
+                    "corrente_avg": r.corrente_sum / r.samples,
+                    "tensao_avg": r.tensao_sum / r.samples,
+                    "potencia_avg": r.potencia_sum / r.samples,
+                    "energia_wh": r.energia_wh,
+                }
+                for r in rollups
+            ],
+            "total": len(rollups),
+        }
+
+    async def delete_device(self, device_id: str) -> DefaultResponse:
+        device = await self.db.get(DeviceModel, device_id)
         if not device:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, detail="Dispositivo não encontrado"
             )
         try:
-            self.db.delete(device)
-            self.db.commit()
+            # Apaga o histórico direto no banco em vez de carregar todas as
+            # leituras na sessão só para o cascade do ORM.
+            await self.db.execute(delete(DeviceDataModel).where(DeviceDataModel.device_id == device_id))
+            await self.db.execute(delete(DeviceRollupModel).where(DeviceRollupModel.device_id == device_id))
+            await self.db.delete(device)
+            await self.db.commit()
+            recent_readings.forget([device_id])
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -130,29 +341,23 @@ class DeviceService:
         return DefaultResponse(msg="Dispositivo excluído com sucesso")
     
     async def connect_device(self, device_id: str) -> DefaultResponse:
-        device = self.db.query(DeviceModel).filter(DeviceModel.id == device_id).first()
+        device = await self.db.get(DeviceModel, device_id)
         if not device:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Dispositivo {device_id} não encontrado."
             )
-        update_connection_status(self.db, device_id, connected=False)
+        presence.set_connected(device_id, False)
 
         try:
-            result = await asyncio.get_running_loop().run_in_executor(
-                None, send_connect_message, self.db, device_id
+            await command_bus.request(device_id, "connect")
+        except asyncio.TimeoutError:
+            print(f"Tempo esgotado. Dispositivo {device_id} não respondeu.")
+            presence.set_connected(device_id, False)
+            raise HTTPException(
+                status_code=status.HTTP_408_REQUEST_TIMEOUT,
+                detail=f"Tempo esgotado ao conectar o dispositivo {device_id}."
             )
-
-            if result == "connected":
-                update_connection_status(self.db, device_id, connected=True)
-                return {"msg": f"Dispositivo {device_id} conectado com sucesso!"}
-
-            if result == "timeout":
-                raise HTTPException(
-                    status_code=status.HTTP_408_REQUEST_TIMEOUT,
-                    detail=f"Tempo esgotado ao conectar o dispositivo {device_id}."
-                )
-
         except Exception as e:
             print(f"Erro ao conectar o dispositivo {device_id}: {e}")
             raise HTTPException(
@@ -160,28 +365,20 @@ class DeviceService:
                 detail=f"Erro ao conectar dispositivo: {e}"
             )
 
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Erro desconhecido ao conectar dispositivo."
-        )
+        presence.touch(device_id)
+        print(f"Dispositivo {device_id} conectado com sucesso!")
+        return {"msg": f"Dispositivo {device_id} conectado com sucesso!"}
 
     async def disconnect_device(self, device_id: str) -> DefaultResponse:
-        device = self.db.query(DeviceModel).filter(DeviceModel.id == device_id).first()
+        device = await self.db.get(DeviceModel, device_id)
         if not device:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, detail="Dispositivo não encontrado"
             )
-        device.connected = False
-        try:
-            self.db.commit()
-        except Exception as e:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Erro ao desconectar dispositivo: {str(e)}",
-            )
+        presence.set_connected(device_id, False)
         try:
             print(f"Publicando desconexão para {device_id}")
-            await publish_disconnect_message(device_id)
+            command_bus.publish(device_id, "disconnect")
         except Exception as e:
             print(f"Erro ao publicar desconexão no MQTT: {e}")
             raise HTTPException(
@@ -190,3 +387,76 @@ class DeviceService:
             )
 
         return DefaultResponse(msg="Dispositivo desconectado com sucesso")
+
+    @staticmethod
+    def _too_many_targets(count: int) -> HTTPException:
+        return HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_CONTENT,
+            detail=f"{count} dispositivos no comando; o máximo é {COMMAND_BULK_MAX_DEVICES}",
+        )
+
+    async def send_bulk_command(
+        self,
+        command: str,
+        device_ids: Optional[list[str]] = None,
+        community_id: Optional[int] = None,
+        timeout: Optional[float] = None,
+    ) -> BulkCommandResult:
+        if timeout is not None and timeout > COMMAND_MAX_TIMEOUT:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_CONTENT,
+                detail=f"timeout deve ser no máximo {COMMAND_MAX_TIMEOUT:g} segundos",
+            )
+        if device_ids and len(device_ids) > COMMAND_BULK_MAX_DEVICES:
+            raise self._too_many_targets(len(device_ids))
+        targets = await self.resolve_devices(device_ids, community_id)
+        if len(targets) > COMMAND_BULK_MAX_DEVICES:
+            raise self._too_many_targets(len(targets))
+        # Devolve a conexão ao pool enquanto as respostas são aguardadas.
+        await self.db.rollback()
+        timeout = timeout or COMMAND_TIMEOUT
+        started = time.perf_counter()
+
+        # Todos os comandos saem de uma vez e cada resposta é aguardada até o
+        # mesmo prazo, então a chamada inteira dura no máximo timeout segundos.
+        outcomes = []
+        if command == "connect":
+            for device_id in targets:
+                presence.set_connected(device_id, False)
+            outcomes = await asyncio.gather(
+                *(command_bus.request(device_id, "connect", timeout) for device_id in targets),
+                return_exceptions=True,
+            )
+        else:
+            for device_id in targets:
+                presence.set_connected(device_id, False)
+                try:
+                    command_bus.publish(device_id, "disconnect")
+                    outcomes.append(None)
+                except Exception as e:
+                    outcomes.append(e)
+
+        results = []
+        for device_id, outcome in zip(targets, outcomes):
+            if isinstance(outcome, asyncio.TimeoutError):
+                results.append({"device_id": device_id, "status": "timeout"})
+            elif isinstance(outcome, Exception):
+                print(f"Erro ao enviar {command} para o dispositivo {device_id}: {outcome}")
+                results.append({"device_id": device_id, "status": "error", "detail": str(outcome)})
+            elif command == "connect":
+                presence.touch(device_id)
+                results.append({"device_id": device_id, "status": "acknowledged", "response": outcome})
+            else:
+                results.append({"device_id": device_id, "status": "sent"})
+
+        statuses = [r["status"] for r in results]
+        return {
+            "command": command,
+            "results": results,
+            "total": len(results),
+            "acknowledged": statuses.count("acknowledged"),
+            "sent": statuses.count("sent"),
+            "timed_out": statuses.count("timeout"),
+            "failed": statuses.count("error"),
+            "elapsed": round(time.perf_counter() - started, 3),
+        }
@@ -0,0 +1,150 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Iterator, Optional, Union
+import pyarrow as pa
+import pyarrow.parquet as pq
+from decouple import config
+from fastapi import HTTPException, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from app.db.connection import Session as SessionFactory
+from app.db.models import DeviceDataModel
+
+EXPORT_CHUNK_SIZE = config('EXPORT_CHUNK_SIZE', default=5000, cast=int)
+
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+EXPORT_FORMAT_PATTERN = f"^({'|'.join(EXPORT_MEDIA_TYPES)})$"
+EXPORT_COLUMNS = ("id", "device_id", "corrente", "tensao", "timestamp")
+ARROW_SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("device_id", pa.string()),
+    ("corrente", pa.float64()),
+    ("tensao", pa.float64()),
+    ("timestamp", pa.timestamp("us", tz="UTC")),
+])
+
+
+class _ChunkSink(io.RawIOBase):
+    def __init__(self):
+        self._chunks: list[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ExportService:
+    def export(
+        self,
+        device_ids: list[str],
+        export_format: str,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ) -> StreamingResponse:
+        if export_format not in EXPORT_MEDIA_TYPES:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Formato de exportação inválido: {export_format}")
+
+        filename = f"{device_ids[0] if len(device_ids) == 1 else 'devices'}.{export_format}"
+        return StreamingResponse(
+            self._render(export_format, self._iter_chunks(device_ids, start, end)),
+            media_type=EXPORT_MEDIA_TYPES[export_format],
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        )
+
+    def _query(self, device_ids: list[str], start: Optional[datetime], end: Optional[datetime]):
+        statement = select(
+            DeviceDataModel.id,
+            DeviceDataModel.device_id,
+            DeviceDataModel.corrente,
+            DeviceDataModel.tensao,
+            DeviceDataModel.timestamp,
+        ).where(DeviceDataModel.device_id.in_(device_ids))
+        if start is not None:
+            statement = statement.where(DeviceDataModel.timestamp >= start)
+        if end is not None:
+            statement = statement.where(DeviceDataModel.timestamp < end)
+        return statement.order_by(DeviceDataModel.device_id, DeviceDataModel.timestamp, DeviceDataModel.id)
+
+    def _iter_chunks(self, device_ids: list[str], start: Optional[datetime], end: Optional[datetime]) -> Iterator[list]:
+        # O cursor do servidor fica aberto durante toda a transmissão, então usa
+        # uma sessão própria, fechada quando o corpo termina ou o cliente cai;
+        # a rota não mantém nenhuma outra sessão aberta enquanto isso.
+        db = SessionFactory()
+        try:
+            result = db.execute(
+                self._query(device_ids, start, end),
+                execution_options={"yield_per": EXPORT_CHUNK_SIZE},
+            )
+            for rows in result.partitions():
+                yield rows
+        finally:
+            db.close()
+
+    def _render(self, export_format: str, chunks: Iterator[list]) -> Iterator[Union[str, bytes]]:
+        if export_format in ("arrow", "parquet"):
+            yield from self._render_columnar(export_format, chunks)
+            return
+
+        if export_format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(EXPORT_COLUMNS)
+            yield buffer.getvalue()
+            for rows in chunks:
+                buffer.seek(0)
+                buffer.truncate()
+                writer.writerows((r.id, r.device_id, r.corrente, r.tensao, r.timestamp.isoformat()) for r in rows)
+                yield buffer.getvalue()
+            return
+
+        for rows in chunks:
+            yield "".join(
+                json.dumps({
+                    "id": r.id,
+                    "device_id": r.device_id,
+                    "corrente": r.corrente,
+                    "tensao": r.tensao,
+                    "timestamp": r.timestamp.isoformat(),
+                }) + "\n"
+                for r in rows
+            )
+
+    def _render_columnar(self, export_format: str, chunks: Iterator[list]) -> Iterator[bytes]:
+        sink = _ChunkSink()
+        if export_format == "parquet":
+            writer = pq.ParquetWriter(sink, ARROW_SCHEMA)
+        else:
+            writer = pa.ipc.new_stream(sink, ARROW_SCHEMA)
+
+        for rows in chunks:
+            columns = list(zip(*rows))
+            writer.write_batch(pa.RecordBatch.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, ARROW_SCHEMA)],
+                schema=ARROW_SCHEMA,
+            ))
+            data = sink.drain()
+            if data:
+                yield data
+
+        writer.close()
+        yield sink.drain()
@@ -0,0 +1,372 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+from decouple import config
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session as SessionType
+from app.db.connection import Session
+from app.db.errors import is_connection_error
+from app.db.models import DeviceDataModel, DeviceModel
+from app.utils.metrics import Gauge, db_commit_seconds, ingest_batch_size, ingest_readings, ingest_write_seconds
+from app.utils.presence import presence
+from app.utils.recent import recent_readings
+from app.utils.rollups import rollups
+from app.utils.spool import SPOOL_DIR, SPOOL_REPLAY_BUDGET, SPOOL_RETRY_INTERVAL, Spool
+
+INGEST_BATCH_SIZE = config('INGEST_BATCH_SIZE', default=500, cast=int)
+INGEST_LINGER_MS = config('INGEST_LINGER_MS', default=200, cast=int)
+INGEST_QUEUE_SIZE = config('INGEST_QUEUE_SIZE', default=100000, cast=int)
+INGEST_OVERFLOW_POLICY = config('INGEST_OVERFLOW_POLICY', default='downsample')
+
+OVERFLOW_POLICIES = ("block", "drop_oldest", "downsample")
+
+
+class IngestQueue:
+    # Fila limitada entre a decodificação (thread do MQTT) e o gravador. Quando
+    # o banco fica lento e a fila enche, a política decide o que perder:
+    # block    - segura a thread do MQTT até haver espaço (nenhuma leitura perdida);
+    # drop_oldest - descarta a leitura mais antiga da fila;
+    # downsample  - guarda só a leitura mais nova de cada dispositivo até a fila
+    #               esvaziar (no máximo uma por dispositivo além da capacidade).
+    def __init__(self, maxsize: int = INGEST_QUEUE_SIZE, policy: str = INGEST_OVERFLOW_POLICY):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"INGEST_OVERFLOW_POLICY inválida: {policy} (use {', '.join(OVERFLOW_POLICIES)})")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+        self.blocked = 0
+        self.high_watermark = 0
+        self._items: deque = deque()
+        self._latest: Dict[str, Dict] = {}
+        self._condition = threading.Condition()
+
+    def put(self, reading: Dict):
+        with self._condition:
+            self._put(reading)
+            self._condition.notify()
+
+    def put_many(self, readings: List[Dict]):
+        with self._condition:
+            for reading in readings:
+                self._put(reading)
+            self._condition.notify()
+
+    def _put(self, reading: Dict):
+        if len(self._items) + len(self._latest) >= self.maxsize:
+            if self.policy == "block":
+                self.blocked += 1
+                while len(self._items) + len(self._latest) >= self.maxsize:
+                    self._condition.wait()
+            elif self.policy == "drop_oldest":
+                self._items.popleft()
+                self.dropped += 1
+            else:
+                if reading["device_id"] in self._latest:
+                    self.dropped += 1
+                self._latest[reading["device_id"]] = reading
+                return
+        self._items.append(reading)
+        self.high_watermark = max(self.high_watermark, len(self._items) + len(self._latest))
+
+    def get(self, block: bool = True, timeout: Optional[float] = None) -> Dict:
+        with self._condition:
+            if block and not self._items and not self._latest:
+                self._condition.wait_for(lambda: self._items or self._latest, timeout)
+            if self._items:
+                reading = self._items.popleft()
+            elif self._latest:
+                reading = self._latest.pop(next(iter(self._latest)))
+            else:
+                raise queue.Empty
+            self._condition.notify_all()
+            return reading
+
+    def get_nowait(self) -> Dict:
+        return self.get(block=False)
+
+    def qsize(self) -> int:
+        with self._condition:
+            return len(self._items) + len(self._latest)
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+
+class IngestWriter:
+    def __init__(self, batch_size: int = INGEST_BATCH_SIZE, linger: float = INGEST_LINGER_MS / 1000):
+        self.batch_size = batch_size
+        self.linger = linger
+        self._queue = IngestQueue()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._reported_dropped = 0
+        self.spool = Spool()
+        self._replay_at = 0.0
+
+    def enqueue(self, reading: Dict):
+        self._queue.put(reading)
+
+    def enqueue_many(self, readings: List[Dict]):
+        self._queue.put_many(readings)
+
+    def status(self) -> Dict:
+        return {
+            "running": bool(self._thread and self._thread.is_alive()),
+            "policy": self._queue.policy,
+            "capacity": self._queue.maxsize,
+            "depth": self._queue.qsize(),
+            "high_watermark": self._queue.high_watermark,
+            "dropped": self._queue.dropped,
+            "blocked": self._queue.blocked,
+            "spool": self.spool.status(),
+        }
+
+    def start(self, spool_name: str = "api"):
+        if self._thread and self._thread.is_alive():
+            return
+        # Cada processo tem o próprio diretório de spool; um worker reiniciado
+        # retoma os segmentos que ficaram no diretório que ele pegar.
+        self.spool.claim(os.path.join(SPOOL_DIR, spool_name))
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+        self._thread.start()
+        print(f"Gravador de leituras iniciado (lote={self.batch_size}, espera={self.linger}s)")
+
+    def stop(self, timeout: float = 30):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                print(f"Gravador de leituras não terminou em {timeout}s; {self._queue.qsize()} leituras pendentes")
+                return
+            self._thread = None
+        self.spool.close()
+
+    def _next_batch(self, linger: float) -> List[Dict]:
+        try:
+            first = self._queue.get(timeout=linger) if linger > 0 else self._queue.get_nowait()
+        except queue.Empty:
+            return []
+
+        batch = [first]
+        deadline = time.monotonic() + linger
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop_event.is_set() or not self._queue.empty():
+            try:
+                self._cycle()
+            except Exception as e:
+                # Um erro inesperado não pode encerrar a thread: com a política
+                # block a thread do MQTT ficaria presa na fila cheia.
+                print(f"Erro no gravador de leituras: {e}")
+                time.sleep(self.linger)
+        presence.flush(force=True)
+        print("Gravador de leituras finalizado")
+
+    def _cycle(self):
+        draining = self._stop_event.is_set()
+        replaying = not draining and self.spool.pending() and time.monotonic() >= self._replay_at
+        batch = self._next_batch(0 if draining or replaying else self.linger)
+        if batch:
+            if self.spool.pending():
+                # Enquanto houver spool, as leituras novas entram atrás dele
+                # para chegar ao banco na ordem em que foram recebidas. Vai
+                # tudo o que está na fila, para ela não encher durante a
+                # regravação.
+                self._spool(batch + self._take(self._queue.qsize()))
+            else:
+                self.flush(batch)
+            self._report_overload()
+        if replaying:
+            self._replay(SPOOL_REPLAY_BUDGET)
+        presence.flush()
+
+    def _take(self, count: int) -> List[Dict]:
+        readings = []
+        for _ in range(count):
+            try:
+                readings.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return readings
+
+    def _spool(self, batch: List[Dict]):
+        try:
+            self.spool.append(batch)
+            ingest_readings.inc("spooled", amount=len(batch))
+        except OSError as e:
+            ingest_readings.inc("lost", amount=len(batch))
+            print(f"Erro ao gravar {len(batch)} leituras no spool: {e}")
+
+    def _replay(self, budget: float):
+        # Regrava lotes até alcançar as leituras ao vivo ou gastar o tempo do
+        # ciclo; com um lote por ciclo o spool cresceria sem limite sob carga.
+        deadline = time.monotonic() + budget
+        while self.spool.pending() and time.monotonic() < deadline:
+            if not self._replay_batch():
+                return
+
+    def _replay_batch(self) -> bool:
+        try:
+            rows = self.spool.read(self.batch_size)
+        except OSError as e:
+            print(f"Erro ao ler o spool: {e}")
+            self._replay_at = time.monotonic() + SPOOL_RETRY_INTERVAL
+            return False
+        try:
+            self._write(rows, "replay")
+        except Exception as e:
+            if is_connection_error(e):
+                self.spool.rewind()
+                self._replay_at = time.monotonic() + SPOOL_RETRY_INTERVAL
+                return False
+            ingest_readings.inc("lost", amount=len(rows))
+            print(f"Descartando {len(rows)} leituras do spool: {e}")
+        try:
+            self.spool.commit(len(rows))
+        except OSError as e:
+            # O segmento já saiu da lista; se o arquivo ficou no disco ele é
+            # relido no próximo start e o ON CONFLICT descarta o que já entrou.
+            print(f"Erro ao remover segmento do spool: {e}")
+            self._replay_at = time.monotonic() + SPOOL_RETRY_INTERVAL
+            return False
+        if not self.spool.pending():
+            print(f"Spool esvaziado: {self.spool.replayed} leituras regravadas")
+        return bool(rows)
+
+    def _report_overload(self):
+        dropped = self._queue.dropped
+        if dropped > self._reported_dropped:
+            print(f"Fila de ingestão cheia ({self._queue.policy}): {dropped - self._reported_dropped} leituras descartadas, {self._queue.qsize()} pendentes")
+            self._reported_dropped = dropped
+
+    def flush(self, batch: List[Dict]):
+        try:
+            self._write(batch)
+        except Exception as e:
+            if is_connection_error(e):
+                print(f"Banco indisponível, guardando lote de {len(batch)} leituras no spool: {e}")
+                self._spool(batch)
+                self._replay_at = time.monotonic() + SPOOL_RETRY_INTERVAL
+                return
+            ingest_readings.inc("lost", amount=len(batch))
+            print(f"Erro ao salvar lote de {len(batch)} leituras: {e}")
+
+    def _write(self, batch: List[Dict], source: str = "live"):
+        if not batch:
+            return
+        ingest_batch_size.observe(len(batch))
+        start = time.perf_counter()
+        db = Session()
+        try:
+            device_ids = {reading["device_id"] for reading in batch}
+            known_ids = set(db.scalars(select(DeviceModel.id).where(DeviceModel.id.in_(device_ids))))
+            rows = [reading for reading in batch if reading["device_id"] in known_ids]
+            if len(rows) < len(batch):
+                ingest_readings.inc("unknown_device", amount=len(batch) - len(rows))
+                print(f"Descartando {len(batch) - len(rows)} leituras de dispositivos não cadastrados: {device_ids - known_ids}")
+                recent_readings.forget(device_ids - known_ids)
+            if not rows:
+                return
+
+            # Um lote que não chega ao banco não pode avançar o estado do
+            # cálculo de energia, senão a regravação perde o intervalo.
+            checkpoint = rollups.checkpoint(device_ids)
+            try:
+                try:
+                    stored = self._insert(db, rows)
+                    rollups.apply(db, stored)
+                    self._commit(db, source)
+                except DBAPIError as e:
+                    # Um erro nos dados de uma leitura (conflito, valor inválido)
+                    # não pode levar junto as outras do lote.
+                    if is_connection_error(e):
+                        raise
+                    db.rollback()
+                    rollups.restore(checkpoint)
+                    print(f"Erro ao gravar lote, gravando leituras individualmente: {e.orig}")
+                    self._flush_one_by_one(db, rows, source)
+                    ingest_write_seconds.observe(time.perf_counter() - start, source)
+                    return
+            except Exception:
+                rollups.restore(checkpoint)
+                raise
+            ingest_write_seconds.observe(time.perf_counter() - start, source)
+            duplicates = len(rows) - len(stored)
+            ingest_readings.inc("stored", amount=len(stored))
+            if duplicates:
+                ingest_readings.inc("duplicate", amount=duplicates)
+            print(f"Lote de {len(stored)} leituras armazenado" + (f" ({duplicates} repetidas ignoradas)" if duplicates else ""))
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    @staticmethod
+    def _commit(db: SessionType, source: str):
+        start = time.perf_counter()
+        db.commit()
+        db_commit_seconds.observe(time.perf_counter() - start, source)
+
+    @staticmethod
+    def _insert(db: SessionType, rows: List[Dict]) -> List[Dict]:
+        # Reentregas QoS 1 chegam com o mesmo (id, timestamp) e são descartadas
+        # pelo ON CONFLICT; o RETURNING diz quais linhas entraram de fato, e só
+        # elas contam nos rollups.
+        table = DeviceDataModel.__table__
+        statement = (
+            insert(DeviceDataModel)
+            .on_conflict_do_nothing(index_elements=[table.c.id, table.c.timestamp])
+            .returning(DeviceDataModel.id, DeviceDataModel.timestamp)
+        )
+        inserted = set(db.execute(statement, rows).tuples())
+        stored = []
+        for row in rows:
+            key = (row["id"], row["timestamp"])
+            if key in inserted:
+                inserted.discard(key)
+                stored.append(row)
+        return stored
+
+    def _flush_one_by_one(self, db: SessionType, rows: List[Dict], source: str):
+        stored = []
+        for row in rows:
+            try:
+                with db.begin_nested():
+                    stored.extend(self._insert(db, [row]))
+            except DBAPIError as e:
+                if is_connection_error(e):
+                    raise
+                print(f"Leitura {row['id']} descartada: {e.orig}")
+        rollups.apply(db, stored)
+        self._commit(db, source)
+        ingest_readings.inc("stored", amount=len(stored))
+        ingest_readings.inc("rejected", amount=len(rows) - len(stored))
+        print(f"Lote armazenado individualmente: {len(stored)}/{len(rows)} leituras")
+
+
+ingest_writer = IngestWriter()
+
+Gauge("ohmni_ingest_queue_depth", "Leituras na fila aguardando gravação.", lambda: {(): ingest_writer._queue.qsize()})
+Gauge(
+    "ohmni_ingest_queue_overflow_total",
+    "Leituras descartadas e esperas da thread do MQTT com a fila de ingestão cheia.",
+    lambda: {("dropped",): ingest_writer._queue.dropped, ("blocked",): ingest_writer._queue.blocked},
+    ("event",),
+    kind="counter",
+)
+Gauge("ohmni_spool_pending_bytes", "Bytes do spool ainda não regravados no banco.", lambda: {(): ingest_writer.spool.size()})
+Gauge("ohmni_spool_oldest_age_seconds", "Idade do segmento mais antigo do spool.", lambda: {(): ingest_writer.spool.oldest_age() or 0})
@@ -0,0 +1,214 @@
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+from decouple import config
+
+METRICS_PORT = config('METRICS_PORT', default=0, cast=int)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        # Cada thread escreve no próprio dicionário, então incrementar não
+        # precisa de lock; a soma entre as threads só acontece na coleta.
+        self._local = threading.local()
+        self._shards: List[Dict] = []
+        registry.register(self)
+
+    def _shard(self) -> Dict:
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = {}
+            self._shards.append(values)
+            return values
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def total(self, *labels) -> float:
+        return sum(shard.get(labels, 0) for shard in list(self._shards))
+
+    def collect(self) -> List[str]:
+        totals: Dict[Tuple, float] = {}
+        for shard in list(self._shards):
+            for labels, value in shard.copy().items():
+                totals[labels] = totals.get(labels, 0) + value
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labels, labels)} {value}" for labels, value in sorted(totals.items())
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        shard = self._shard()
+        # [contagem por faixa..., acima da última faixa, soma]
+        counts = shard.get(labels)
+        if counts is None:
+            counts = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def collect(self) -> List[str]:
+        totals: Dict[Tuple, List] = {}
+        for shard in list(self._shards):
+            for labels, counts in shard.copy().items():
+                total = totals.setdefault(labels, [0] * len(counts))
+                for index, value in enumerate(list(counts)):
+                    total[index] += value
+        lines = self.header()
+        for labels, counts in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {counts[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+
+class Gauge(_Metric):
+    # Valor lido na coleta a partir do estado que já existe (fila, presença,
+    # pool); kind="counter" para totais que o próprio estado já acumula.
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], Dict[Tuple, float]],
+        labels: Tuple[str, ...] = (),
+        kind: str = "gauge",
+    ):
+        super().__init__(name, documentation, labels)
+        self.callback = callback
+        self.kind = kind
+
+    def collect(self) -> List[str]:
+        try:
+            values = self.callback()
+        except Exception as e:
+            print(f"Erro ao coletar a métrica {self.name}: {e}")
+            return []
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labels, labels)} {value}" for labels, value in sorted(values.items())
+        ]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+mqtt_messages = Counter("ohmni_mqtt_messages_total", "Mensagens MQTT recebidas por tipo de tópico.", ("kind",))
+mqtt_decode_failures = Counter("ohmni_mqtt_decode_failures_total", "Mensagens MQTT que não puderam ser decodificadas.", ("kind",))
+ingest_readings = Counter("ohmni_ingest_readings_total", "Leituras processadas pelo gravador por resultado.", ("result",))
+ingest_batch_size = Histogram("ohmni_ingest_batch_size", "Leituras por lote gravado.", buckets=BATCH_BUCKETS)
+ingest_write_seconds = Histogram("ohmni_ingest_write_seconds", "Duração da gravação de um lote de leituras (insert, rollups e commit).", ("source",))
+db_commit_seconds = Histogram("ohmni_db_commit_seconds", "Duração do COMMIT das transações de ingestão.", ("source",))
+db_pool_checkout_seconds = Histogram("ohmni_db_pool_checkout_seconds", "Espera para obter uma conexão do pool.", ("engine",))
+http_request_seconds = Histogram("ohmni_http_request_seconds", "Latência das requisições HTTP por rota.", ("method", "route", "status"))
+
+
+class RouteMetricsMiddleware:
+    # Middleware ASGI puro: mede a requisição até o fim do corpo, inclusive em
+    # respostas transmitidas, e usa o caminho da rota (/devices/{device_id})
+    # para não criar uma série por id.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_code[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            http_request_seconds.observe(
+                time.perf_counter() - start,
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                status_code[0],
+            )
+
+
+def serve_metrics(port: int = METRICS_PORT) -> Optional[ThreadingHTTPServer]:
+    # Os processos de ingestão não têm servidor HTTP próprio; com uma porta
+    # definida eles expõem /metrics numa thread à parte.
+    if not port:
+        return None
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Métricas disponíveis em http://0.0.0.0:{port}/metrics")
+    return server
@@ -1,100 +1,78 @@
-import asyncio
 import threading
-from collections import deque
 import paho.mqtt.client as mqtt
 import json
 import time
-from typing import Dict
-from datetime import datetime, timezone
-from app.db.models import DeviceDataModel, DeviceModel
-from app.depends import get_db_session
-from app.schemas import MqttPayload
-from sqlalchemy.orm import Session
-
-BROKER = "e89dd3b4d73248a29def221deeafac4c.s1.eu.hivemq.cloud"
-PORT = 8883
-USERNAME = "ohmni"
-PASSWORD = "Ohmni2024"
+from typing import Optional
+from decouple import config
+from paho.mqtt.subscribeoptions import SubscribeOptions
+from app.utils.broadcast import broadcast_hub
+from app.utils.commands import command_bus, is_command_message
+from app.utils.ingest import ingest_writer
+from app.utils.metrics import mqtt_decode_failures, mqtt_messages
+from app.utils.partitioning import device_partition
+from app.utils.payloads import decode_readings
+from app.utils.presence import presence
+from app.utils.recent import recent_readings
+
+BROKER = config('MQTT_BROKER', default="e89dd3b4d73248a29def221deeafac4c.s1.eu.hivemq.cloud")
+PORT = config('MQTT_PORT', default=8883, cast=int)
+USERNAME = config('MQTT_USERNAME', default="ohmni")
+PASSWORD = config('MQTT_PASSWORD', default="Ohmni2024")
+TLS = config('MQTT_TLS', default=True, cast=bool)
 TOPIC = "iot/+/data"
+# Com um grupo definido, a ingestão assina $share/<grupo>/iot/+/data e o broker
+# divide as leituras entre os processos do grupo. Sem grupo, cada processo
+# recebe todas e fica só com os seus dispositivos (app/utils/partitioning.py).
+SHARED_GROUP = config('MQTT_SHARED_GROUP', default="")
 
-devices_data: Dict[str, deque] = {}
-connection_status: Dict[str, Dict[str, float]] = {}
-connection_events: Dict[str, threading.Event] = {}
+def data_topic(group: str = SHARED_GROUP) -> str:
+    return f"$share/{group}/{TOPIC}" if group else TOPIC
 
-devices_data_lock = threading.Lock()
-connection_status_lock = threading.Lock()
+def device_data_topic(device_id: str) -> str:
+    return f"iot/{device_id}/data"
 
-async def publish_disconnect_message(device_id: str):
+def on_message_handler(msg):
     try:
-        result = await asyncio.to_thread(mqtt_client.publish, f"iot/{device_id}/connect", "disconnect", qos=1)
-        if result.rc != mqtt.MQTT_ERR_SUCCESS:
-            raise Exception(f"Erro ao publicar mensagem MQTT: Código {result.rc}")
-        print(f"Mensagem de desconexão enviada para {device_id}, resultado: {result}")
-    except Exception as e:
-        print(f"Erro ao publicar mensagem de disconexão: {e}")
-        raise
-
-def store_device_data(db: Session, device_id: str, data: Dict):
-    try:
-        device = db.query(DeviceModel).filter(DeviceModel.id == device_id).first()
-        if not device:
-            device = DeviceModel(id=device_id, connected=True, last_seen=time.time())
-            db.add(device)
-
-        device_data = DeviceDataModel(
-            id=f"{device_id}-{int(time.time())}",
-            device_id=device_id,
-            corrente=data["corrente"],
-            tensao=data["tensao"],
-            timestamp=datetime.now(timezone.utc)
-        )
-        db.add(device_data)
-        db.commit()
-        print(f"Dados armazenados para {device_id}: {data}")
-    except Exception as e:
-        db.rollback()
-        print(f"Erro ao salvar dados para {device_id}: {e}")
-        raise
-
-def update_connection_status(db: Session, device_id: str, connected: bool, last_seen: float = 0):
-    try:
-        device = db.query(DeviceModel).filter(DeviceModel.id == device_id).first()
-        if not device:
-            device = DeviceModel(id=device_id, connected=connected, last_seen=last_seen)
-            db.add(device)
-        else:
-            device.connected = connected
-            device.last_seen = last_seen
-        db.commit()
-        print(f"Estado atualizado para {device_id}: conectado={connected}, visto={last_seen}")
-    except Exception as e:
-        db.rollback()
-        print(f"Erro ao atualizar estado do dispositivo {device_id}: {e}")
-        raise
-
-def on_message_handler(db: Session, msg):
-    try:
-        payload = msg.payload.decode().strip()
-        if not payload:
+        if not msg.payload.strip():
             return
 
-        if msg.topic.endswith("/connect"):
+        if msg.topic == command_bus.response_topic:
+            mqtt_messages.inc("response")
+            device_id = command_bus.handle_response(msg)
+            if device_id is not None:
+                presence.touch(device_id)
+        elif msg.topic.endswith("/connect"):
+            if is_command_message(msg):
+                mqtt_messages.inc("command")
+                return
+            mqtt_messages.inc("connect")
             device_id = msg.topic.split("/")[1]
-            update_connection_status(db, device_id, connected=True, last_seen=time.time())
-            
-            if device_id in connection_events:
-                connection_events[device_id].set()
+            if ingest_enabled and not device_partition.owns(device_id):
+                return
+            presence.touch(device_id)
+            command_bus.handle_legacy_reply(device_id, msg.payload.decode().strip())
         else:
-            payload_dict = json.loads(payload)
-            store_device_data(
-                db,
-                device_id=payload_dict["id"],
-                data={
-                    "corrente": payload_dict["corrente"],
-                    "tensao": payload_dict["tensao"],
-                },
-            )
-            update_connection_status(db, payload_dict["id"], connected=True, last_seen=time.time())
+            # Leituras de dispositivos de outro processo de ingestão, ou sem
+            # assinante ao vivo numa API sem ingestão, são descartadas pelo
+            # tópico, antes de decodificar o payload.
+            topic_device = msg.topic.split("/")[1]
+            if ingest_enabled and not device_partition.owns(topic_device):
+                return
+            if not ingest_enabled and not broadcast_hub.has_subscribers(topic_device):
+                return
+            mqtt_messages.inc("data")
+            try:
+                readings = decode_readings(msg.topic, msg.payload)
+            except Exception:
+                mqtt_decode_failures.inc("data")
+                raise
+            # As assinaturas ao vivo só guardam a leitura mais nova de cada
+            # dispositivo, então basta repassar a última da mensagem.
+            broadcast_hub.publish(readings[-1])
+            if ingest_enabled:
+                presence.touch(readings[-1]["device_id"])
+                recent_readings.extend(readings)
+                ingest_writer.enqueue_many(readings)
     except json.JSONDecodeError as e:
         print(f"Erro ao decodificar JSON: {e}")
     except Exception as e:
@@ -102,23 +80,35 @@ def on_message_handler(db: Session, msg):
 
 
 def callbackMQTT(client, userdata, msg):
-    db_gen = get_db_session()
-    db = next(db_gen)
-    try:
-        on_message_handler(db, msg)
-    finally:
-        next(db_gen, None)
+    on_message_handler(msg)
 
 
 
 def on_connect(client, userdata, flags, rc, properties=None):
     if rc == 0:
         print("Conectado ao Broker MQTT!")
-        client.subscribe(TOPIC)
-        client.subscribe("iot/+/connect")
+        if ingest_enabled:
+            client.subscribe(data_topic())
+        else:
+            # Sem ingestão as leituras só alimentam WebSocket/SSE: o processo
+            # assina apenas os dispositivos que têm assinante ao vivo.
+            subscribe_live_devices(broadcast_hub.devices(), [])
+        # noLocal: os comandos publicados pela própria API não voltam como resposta.
+        client.subscribe("iot/+/connect", options=SubscribeOptions(qos=1, noLocal=True))
+        client.subscribe(command_bus.response_topic, qos=1)
     else:
         print(f"Erro ao conectar ao Broker MQTT: Código {rc}")
 
+def subscribe_live_devices(added, removed):
+    if ingest_enabled:
+        return
+    # Sem conexão o paho não guarda a assinatura (MQTT_ERR_NO_CONN); o
+    # on_connect assina de novo tudo o que estiver no hub.
+    if added:
+        mqtt_client.subscribe([(device_data_topic(device_id), 0) for device_id in added])
+    if removed:
+        mqtt_client.unsubscribe([device_data_topic(device_id) for device_id in removed])
+
 def on_disconnect(client, userdata, rc, properties=None):
     if rc != 0:
         print("Desconectado do broker MQTT. Tentando reconectar...")
@@ -131,47 +121,41 @@ def on_disconnect(client, userdata, rc, properties=None):
                 print(f"Erro ao reconectar: {e}")
                 time.sleep(5)
 
-def send_connect_message(db: Session, device_id: str, timeout: int = 10):
-    update_connection_status(db, device_id, connected=False)
-    if device_id not in connection_events:
-        connection_events[device_id] = threading.Event()
-    else:
-        connection_events[device_id].clear()
-
-    try:
-        result = mqtt_client.publish(f"iot/{device_id}/connect", "connect", qos=1)
-        print(f"Mensagem de conexão enviada para {device_id}, resultado: {result}")
-        if result.rc != mqtt.MQTT_ERR_SUCCESS:
-            return f"Erro ao publicar mensagem MQTT: Código {result.rc}"
-    except Exception as e:
-        print(f"Erro ao publicar mensagem MQTT: {e}")
-        return f"Erro ao conectar dispositivo {device_id} ao Broker MQTT: {e}"
-    event_triggered = connection_events[device_id].wait(timeout)
-    if event_triggered:
-        print(f"Dispositivo {device_id} conectado com sucesso!")
-        return "connected"
-    
-    print(f"Tempo esgotado. Dispositivo {device_id} não respondeu.")
-    update_connection_status(db, device_id, connected=False)
-    return "timeout"
-
 def start_mqtt():
     try:
-        mqtt_client.connect(BROKER, PORT, 60)
-        mqtt_client.loop_forever()
+        # Um processo de ingestão pode subir antes do broker: a primeira conexão
+        # também é refeita até funcionar.
+        mqtt_client.connect_async(BROKER, PORT, 60)
+        mqtt_client.loop_forever(retry_first_connection=True)
     except Exception as e:
         print(f"Erro ao conectar ao broker MQTT: {e}")
         raise
 
+def start_mqtt_thread(ingest: bool = False):
+    global mqtt_thread, ingest_enabled
+    if mqtt_thread is not None:
+        return
+    ingest_enabled = ingest
+    mqtt_thread = threading.Thread(target=start_mqtt)
+    mqtt_thread.daemon = True
+    mqtt_thread.start()
+    print("Loop MQTT iniciado")
+
+def stop_mqtt():
+    # disconnect() encerra o loop_forever sem acionar a reconexão.
+    if mqtt_thread is not None:
+        mqtt_client.disconnect()
+        mqtt_thread.join(timeout=5)
+
 mqtt_client = mqtt.Client(transport="tcp", protocol=mqtt.MQTTv5)
 mqtt_client.username_pw_set(USERNAME, PASSWORD)
-mqtt_client.tls_set()
+if TLS:
+    mqtt_client.tls_set()
 mqtt_client.on_connect = on_connect
 mqtt_client.on_message = callbackMQTT
 mqtt_client.on_disconnect = on_disconnect
+command_bus.attach(mqtt_client, start_mqtt_thread)
+broadcast_hub.watch(subscribe_live_devices)
 
-mqtt_thread = threading.Thread(target=start_mqtt)
-mqtt_thread.daemon = True
-mqtt_thread.start()
-
-print("Loop MQTT iniciado")
+mqtt_thread: Optional[threading.Thread] = None
+ingest_enabled = False
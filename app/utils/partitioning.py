@@ -0,0 +1,37 @@
+import zlib
+
+
+class DevicePartition:
+    # Com vários processos de ingestão, cada dispositivo pertence a exatamente
+    # um deles: o crc32 do id (estável entre processos, ao contrário de hash())
+    # módulo o número de processos. Todos assinam iot/+/data e cada um ignora o
+    # que não é seu, então o estado por dispositivo (presença, cálculo de
+    # energia, últimas leituras) nunca se divide entre processos. O custo é que
+    # o broker entrega cada mensagem a todos os processos.
+    #
+    # Com assinatura compartilhada ($share) quem escolhe o processo é o broker:
+    # o processo aceita tudo o que recebe, mas não sabe quais dispositivos são
+    # seus e por isso não assume nenhum ao iniciar.
+    def __init__(self, index: int = 0, count: int = 1):
+        self.configure(index, count)
+
+    def configure(self, index: int, count: int):
+        if not 0 <= index < count:
+            raise ValueError(f"Partição {index} inválida para {count} processos")
+        self.index = index
+        self.count = count
+        self.shared = False
+
+    def share(self):
+        self.index = 0
+        self.count = 1
+        self.shared = True
+
+    def owns(self, device_id: str) -> bool:
+        return self.count == 1 or zlib.crc32(device_id.encode()) % self.count == self.index
+
+    def knows_owned(self) -> bool:
+        return not self.shared
+
+
+device_partition = DevicePartition()
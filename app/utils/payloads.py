@@ -0,0 +1,131 @@
+import json
+import math
+import os
+import struct
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from decouple import config
+from app.schemas import MqttPayload
+
+# Leituras com relógio do dispositivo fora desta janela (atrasadas ou adiantadas
+# demais) recebem o horário de chegada, para não cair fora das partições.
+DEVICE_CLOCK_MAX_AGE = config('DEVICE_CLOCK_MAX_AGE', default=7 * 24 * 3600, cast=int)
+DEVICE_CLOCK_MAX_AHEAD = config('DEVICE_CLOCK_MAX_AHEAD', default=300, cast=int)
+
+# Formato binário v1: um byte de versão seguido de N registros little-endian
+# (timestamp unix em segundos como double, corrente e tensao como float32).
+# O dispositivo vem do tópico iot/<id>/data. Payloads JSON começam com '{'.
+BINARY_V1 = 0x01
+BINARY_V1_RECORD = struct.Struct("<dff")
+
+
+_CROCKFORD = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+
+class UlidGenerator:
+    # ULID: 48 bits de milissegundos + 80 bits aleatórios. Dentro do mesmo
+    # milissegundo a parte aleatória é incrementada, mantendo a ordem.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._last_random = 0
+
+    def new(self) -> str:
+        with self._lock:
+            ms = int(time.time() * 1000)
+            if ms > self._last_ms:
+                self._last_ms = ms
+                self._last_random = int.from_bytes(os.urandom(10), "big")
+            else:
+                self._last_random += 1
+                if self._last_random >> 80:
+                    self._last_ms += 1
+                    self._last_random = int.from_bytes(os.urandom(10), "big")
+            value = (self._last_ms << 80) | self._last_random
+        return "".join(_CROCKFORD[(value >> shift) & 31] for shift in range(125, -1, -5))
+
+
+ulid = UlidGenerator()
+
+
+def reading_id(device_id: str, seq: Optional[int] = None, device_seconds: Optional[float] = None) -> str:
+    # Ids derivados do dispositivo se repetem numa reentrega QoS 1 e a gravação
+    # com ON CONFLICT DO NOTHING (id, timestamp) descarta a cópia; sem eles, um
+    # ULID. Só valem com o horário do dispositivo aceito: com o horário de
+    # chegada a reentrega teria outro timestamp e passaria pelo conflito.
+    if seq is not None:
+        return f"{device_id}-s{seq}"
+    if device_seconds is not None:
+        return f"{device_id}-t{int(device_seconds * 1000)}"
+    return f"{device_id}-{ulid.new()}"
+
+
+def build_reading(device_id: str, data: Dict, timestamp: Optional[datetime] = None, reading_key: Optional[str] = None) -> Dict:
+    return {
+        "id": reading_key or reading_id(device_id),
+        "device_id": device_id,
+        "corrente": data["corrente"],
+        "tensao": data["tensao"],
+        "timestamp": timestamp or datetime.now(timezone.utc),
+    }
+
+
+def device_timestamp(seconds: float, received: float) -> Optional[datetime]:
+    if not received - DEVICE_CLOCK_MAX_AGE <= seconds <= received + DEVICE_CLOCK_MAX_AHEAD:
+        return None
+    return datetime.fromtimestamp(seconds, timezone.utc)
+
+
+def _float32(value: float) -> float:
+    # float32 guarda ~7 dígitos significativos; sem isso 220.1 viraria 220.10000610351562.
+    return float(f"{value:.7g}")
+
+
+def decode_binary_v1(device_id: str, body: bytes) -> List[Dict]:
+    if not body or len(body) % BINARY_V1_RECORD.size:
+        raise ValueError(f"Payload binário v1 com {len(body)} bytes não é múltiplo de {BINARY_V1_RECORD.size}")
+    received = time.time()
+    for _, corrente, tensao in BINARY_V1_RECORD.iter_unpack(body):
+        if not (math.isfinite(corrente) and math.isfinite(tensao)):
+            raise ValueError("Payload binário v1 com corrente ou tensao não finita")
+    readings = []
+    for seconds, corrente, tensao in BINARY_V1_RECORD.iter_unpack(body):
+        timestamp = device_timestamp(seconds, received)
+        readings.append(build_reading(
+            device_id,
+            {"corrente": _float32(corrente), "tensao": _float32(tensao)},
+            timestamp,
+            reading_id(device_id, device_seconds=seconds) if timestamp is not None else None,
+        ))
+    return readings
+
+
+def decode_readings(topic: str, payload: bytes) -> List[Dict]:
+    if payload[:1] == bytes((BINARY_V1,)):
+        return decode_binary_v1(topic.split("/")[1], payload[1:])
+
+    payload_dict = json.loads(payload)
+    # Valores fora do tipo (texto, null, booleanos, NaN) param aqui, e não no
+    # INSERT do lote, onde derrubariam as leituras de outros dispositivos.
+    data = MqttPayload.model_validate(payload_dict)
+    device_id = data.id
+    seq = payload_dict.get("seq")
+    seconds = payload_dict.get("timestamp")
+    timestamp = device_timestamp(float(seconds), time.time()) if seconds is not None else None
+    return [build_reading(
+        device_id,
+        {
+            "corrente": data.corrente,
+            "tensao": data.tensao,
+        },
+        timestamp,
+        reading_id(device_id, int(seq) if seq is not None else None, float(seconds)) if timestamp is not None else None,
+    )]
+
+
+def encode_binary_v1(readings: List[tuple]) -> bytes:
+    return bytes((BINARY_V1,)) + b"".join(
+        BINARY_V1_RECORD.pack(seconds, corrente, tensao) for seconds, corrente, tensao in readings
+    )
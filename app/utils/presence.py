@@ -0,0 +1,247 @@
+import asyncio
+import heapq
+import threading
+import time
+from typing import Dict, Optional
+from decouple import Csv, config
+from sqlalchemy import Boolean, String, column, select, update, values
+from app.db.connection import Session
+from app.db.models import DeviceModel
+from app.utils.metrics import Gauge
+from app.utils.partitioning import device_partition
+
+PRESENCE_FLUSH_INTERVAL = config('PRESENCE_FLUSH_INTERVAL', default=30, cast=int)
+PRESENCE_TIMEOUT = config('PRESENCE_TIMEOUT', default=15, cast=float)
+# Formato "tipo:segundos,tipo:segundos"; tipos ausentes usam PRESENCE_TIMEOUT.
+PRESENCE_TIMEOUT_BY_TYPE = {
+    device_type.strip(): float(seconds)
+    for device_type, seconds in (
+        item.split(":", 1) for item in config('PRESENCE_TIMEOUT_BY_TYPE', default='', cast=Csv())
+    )
+}
+PRESENCE_CHECK_INTERVAL = config('PRESENCE_CHECK_INTERVAL', default=1, cast=float)
+PRESENCE_TYPES_REFRESH = config('PRESENCE_TYPES_REFRESH', default=300, cast=int)
+
+
+def parse_last_seen(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class PresenceTable:
+    def __init__(
+        self,
+        flush_interval: float = PRESENCE_FLUSH_INTERVAL,
+        timeout: float = PRESENCE_TIMEOUT,
+        timeout_by_type: Optional[Dict[str, float]] = None,
+    ):
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.timeout_by_type = PRESENCE_TIMEOUT_BY_TYPE if timeout_by_type is None else timeout_by_type
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._state: Dict[str, Dict] = {}
+        self._transitions: set = set()
+        self._dirty: set = set()
+        self._last_flush = time.monotonic()
+        self._device_types: Dict[str, str] = {}
+        # Heap de (prazo, device_id) com no máximo uma entrada por dispositivo
+        # conectado; o prazo real é conferido só quando a entrada vence.
+        self._deadlines: list = []
+        self._scheduled: set = set()
+        # Sem tracking (API sem ingestão) a tabela só repassa as mudanças para o
+        # banco: as entradas saem da memória no flush e as leituras usam o banco.
+        self.tracking = True
+
+    def touch(self, device_id: str, last_seen: Optional[float] = None) -> bool:
+        return self.set_connected(device_id, True, last_seen if last_seen is not None else time.time())
+
+    def set_connected(self, device_id: str, connected: bool, last_seen: Optional[float] = None) -> bool:
+        with self._lock:
+            entry = self._state.get(device_id)
+            changed = entry is None or entry["connected"] != connected
+            if entry is None:
+                entry = self._state[device_id] = {"connected": connected, "last_seen": 0.0}
+            entry["connected"] = connected
+            if last_seen is not None:
+                entry["last_seen"] = last_seen
+                self._dirty.add(device_id)
+            if changed:
+                self._transitions.add(device_id)
+            if connected and self.tracking:
+                self._schedule(device_id, entry)
+            return changed
+
+    def _timeout_for(self, device_id: str) -> float:
+        return self.timeout_by_type.get(self._device_types.get(device_id), self.timeout)
+
+    def _schedule(self, device_id: str, entry: Dict):
+        if device_id not in self._scheduled:
+            self._scheduled.add(device_id)
+            heapq.heappush(self._deadlines, (entry["last_seen"] + self._timeout_for(device_id), device_id))
+
+    def set_device_type(self, device_id: str, device_type: str):
+        with self._lock:
+            self._device_types[device_id] = device_type
+
+    def load_devices(self, seed: bool = False):
+        db = Session()
+        try:
+            devices = db.execute(
+                select(DeviceModel.id, DeviceModel.type, DeviceModel.connected, DeviceModel.last_seen)
+            ).all()
+        finally:
+            db.close()
+
+        with self._lock:
+            self._device_types = {device.id: device.type for device in devices}
+            if not seed:
+                return
+            # Dispositivos que ficaram marcados como conectados no banco (por
+            # exemplo, após um restart) também passam pelo watchdog, mas só os
+            # deste processo: os outros nunca mandam mensagem para cá e seriam
+            # dados como desconectados enquanto ainda estão ativos. Numa
+            # assinatura compartilhada o processo não sabe quais são os seus.
+            if not device_partition.knows_owned():
+                return
+            for device in devices:
+                if device.connected and device.id not in self._state and device_partition.owns(device.id):
+                    entry = self._state[device.id] = {"connected": True, "last_seen": parse_last_seen(device.last_seen)}
+                    self._schedule(device.id, entry)
+
+    def expire(self) -> list[str]:
+        now = time.time()
+        expired = []
+        with self._lock:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                _, device_id = heapq.heappop(self._deadlines)
+                self._scheduled.discard(device_id)
+                entry = self._state.get(device_id)
+                if entry is None or not entry["connected"]:
+                    continue
+                if entry["last_seen"] + self._timeout_for(device_id) > now:
+                    self._schedule(device_id, entry)
+                    continue
+                entry["connected"] = False
+                self._transitions.add(device_id)
+                expired.append(device_id)
+        return expired
+
+    def is_connected(self, device_id: str, default: bool = False) -> bool:
+        entry = self._state.get(device_id) if self.tracking else None
+        return entry["connected"] if entry is not None else default
+
+    def get(self, device_id: str) -> Optional[Dict]:
+        entry = self._state.get(device_id) if self.tracking else None
+        return dict(entry) if entry is not None else None
+
+    def connected_by_type(self) -> Dict[tuple, int]:
+        counts: Dict[tuple, int] = {}
+        with self._lock:
+            for device_id, entry in self._state.items():
+                if entry["connected"]:
+                    key = (self._device_types.get(device_id, ""),)
+                    counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {device_id: dict(entry) for device_id, entry in self._state.items()}
+
+    def has_pending(self) -> bool:
+        with self._lock:
+            return bool(self._transitions or self._dirty)
+
+    def flush(self, force: bool = False):
+        # O gravador e o watchdog chamam flush de threads diferentes; sem este
+        # lock um retrato antigo (connected=False) poderia ser gravado depois
+        # de um mais novo (True) e ficar no banco até a próxima gravação.
+        with self._flush_lock:
+            self._flush(force)
+
+    def _flush(self, force: bool):
+        with self._lock:
+            due = force or time.monotonic() - self._last_flush >= self.flush_interval
+            pending = set(self._transitions)
+            if due:
+                pending |= self._dirty
+            if not pending:
+                return
+            rows = [
+                (device_id, self._state[device_id]["connected"], str(self._state[device_id]["last_seen"]))
+                for device_id in pending
+            ]
+            self._transitions.clear()
+            if due:
+                self._dirty.clear()
+                self._last_flush = time.monotonic()
+
+        presence_values = values(
+            column("id", String),
+            column("connected", Boolean),
+            column("last_seen", String),
+            name="presence",
+        ).data(rows)
+        devices = DeviceModel.__table__
+        db = Session()
+        try:
+            updated = set(db.scalars(
+                update(devices)
+                .where(devices.c.id == presence_values.c.id)
+                .values(connected=presence_values.c.connected, last_seen=presence_values.c.last_seen)
+                .returning(devices.c.id)
+            ))
+            db.commit()
+            # Ids que não estão cadastrados não viram linha no banco; saem da
+            # memória para a tabela não crescer com cada id desconhecido.
+            unknown = {device_id for device_id, _, _ in rows} - updated
+            with self._lock:
+                for device_id, _, _ in rows:
+                    if device_id in unknown or (
+                        not self.tracking and device_id not in self._transitions and device_id not in self._dirty
+                    ):
+                        self._state.pop(device_id, None)
+                        self._transitions.discard(device_id)
+                        self._dirty.discard(device_id)
+            print(f"Estado de conexão gravado para {len(updated)} dispositivos")
+        except Exception as e:
+            db.rollback()
+            with self._lock:
+                self._transitions.update(device_id for device_id, _, _ in rows)
+                self._dirty.update(device_id for device_id, _, _ in rows)
+            print(f"Erro ao gravar estado de conexão dos dispositivos: {e}")
+        finally:
+            db.close()
+
+
+presence = PresenceTable()
+
+Gauge("ohmni_devices_connected", "Dispositivos conectados segundo a presença deste processo, por tipo.", presence.connected_by_type, ("type",))
+
+
+async def watch_inactive_devices():
+    loaded_at = None
+    while True:
+        try:
+            if loaded_at is None or time.monotonic() - loaded_at >= PRESENCE_TYPES_REFRESH:
+                await asyncio.to_thread(presence.load_devices, loaded_at is None)
+                loaded_at = time.monotonic()
+        except Exception as e:
+            print(f"Erro ao carregar os tipos dos dispositivos: {e}")
+
+        expired = presence.expire()
+        for device_id in expired:
+            print(f"Dispositivo {device_id} desconectado por inatividade.")
+        if expired:
+            # Todas as quedas do ciclo vão para o banco em um único UPDATE.
+            await asyncio.to_thread(presence.flush)
+        await asyncio.sleep(PRESENCE_CHECK_INTERVAL)
+
+
+async def write_presence_changes():
+    while True:
+        if presence.has_pending():
+            await asyncio.to_thread(presence.flush, True)
+        await asyncio.sleep(PRESENCE_CHECK_INTERVAL)
@@ -0,0 +1,195 @@
+import asyncio
+import contextvars
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Dict, List, Optional
+from decouple import config
+from sqlalchemy import event
+
+PROFILING_ENABLED = config('PROFILING_ENABLED', default=False, cast=bool)
+PROFILING_HEADER = config('PROFILING_HEADER', default="X-Profile")
+PROFILING_TOKEN = config('PROFILING_TOKEN', default="")
+PROFILING_SAMPLE_RATE = config('PROFILING_SAMPLE_RATE', default=0.0, cast=float)
+PROFILING_INTERVAL_MS = config('PROFILING_INTERVAL_MS', default=2, cast=float)
+PROFILING_DIR = config('PROFILING_DIR', default="profiles")
+PROFILING_MAX_CAPTURES = config('PROFILING_MAX_CAPTURES', default=200, cast=int)
+
+# Pilha registrada quando o event loop está esperando I/O ou rodando outra
+# tarefa; mostra quanto do tempo de parede a requisição passou parada.
+WAITING_FRAME = "(aguardando I/O ou outras tarefas)"
+
+_current_capture: contextvars.ContextVar = contextvars.ContextVar("profiling_capture", default=None)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    filename = code.co_filename
+    for marker in ("site-packages" + os.sep, os.getcwd() + os.sep):
+        index = filename.find(marker)
+        if index != -1:
+            filename = filename[index + len(marker):]
+            break
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class Capture:
+    def __init__(self, method: str, path: str):
+        self.id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.method = method
+        self.path = path
+        self.stacks: Counter = Counter()
+        self.sql: List[Dict] = []
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self.status: Optional[int] = None
+
+
+class Sampler:
+    # Amostra a pilha da thread do event loop a cada intervalo, mas só conta a
+    # amostra para a requisição se a tarefa em execução for a dela.
+    def __init__(self, capture: Capture, interval: float):
+        self.capture = capture
+        self.interval = interval
+        self.loop = asyncio.get_running_loop()
+        self.task = asyncio.current_task()
+        self.thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiling-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if asyncio.current_task(self.loop) is not self.task:
+                self.capture.stacks[WAITING_FRAME] += 1
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.capture.stacks[";".join(reversed(stack))] += 1
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_capture.get() is not None:
+        conn.info.setdefault("profiling_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    capture = _current_capture.get()
+    if capture is None:
+        return
+    started = conn.info.get("profiling_started")
+    if not started:
+        return
+    capture.sql.append({
+        "statement": statement,
+        "seconds": time.perf_counter() - started.pop(),
+        "rowcount": cursor.rowcount,
+        "executemany": executemany,
+    })
+
+
+def install_sql_hooks(*engines):
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def write_capture(capture: Capture, directory: str = PROFILING_DIR, max_captures: int = PROFILING_MAX_CAPTURES):
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, capture.id)
+    # Formato "collapsed" (uma pilha por linha e o número de amostras), aberto
+    # direto no speedscope ou no flamegraph.pl.
+    with open(f"{base}.collapsed", "w") as handle:
+        handle.writelines(f"{stack} {count}\n" for stack, count in capture.stacks.most_common())
+    with open(f"{base}.json", "w") as handle:
+        json.dump({
+            "id": capture.id,
+            "method": capture.method,
+            "path": capture.path,
+            "status": capture.status,
+            "seconds": capture.elapsed,
+            "samples": sum(capture.stacks.values()),
+            "sql_seconds": sum(query["seconds"] for query in capture.sql),
+            "sql": capture.sql,
+        }, handle, indent=2)
+
+    captures = sorted(
+        (entry.stat().st_mtime_ns, entry.name[:-len(".json")])
+        for entry in os.scandir(directory)
+        if entry.name.endswith(".json")
+    )
+    for _, stale in captures[:max(len(captures) - max_captures, 0)]:
+        for suffix in (".collapsed", ".json"):
+            try:
+                os.remove(os.path.join(directory, stale + suffix))
+            except FileNotFoundError:
+                pass
+
+
+class ProfilingMiddleware:
+    # Perfila uma requisição quando ela traz o cabeçalho com o token certo ou
+    # cai na amostragem. O id da captura volta no mesmo cabeçalho da resposta.
+    def __init__(
+        self,
+        app,
+        header: str = PROFILING_HEADER,
+        token: str = PROFILING_TOKEN,
+        sample_rate: float = PROFILING_SAMPLE_RATE,
+        interval: float = PROFILING_INTERVAL_MS / 1000,
+    ):
+        self.app = app
+        self.header = header.lower().encode()
+        self.token = token.encode()
+        self.sample_rate = sample_rate
+        self.interval = interval
+
+    def _wanted(self, scope) -> bool:
+        if self.token:
+            for name, value in scope["headers"]:
+                if name == self.header and hmac.compare_digest(value, self.token):
+                    return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._wanted(scope):
+            await self.app(scope, receive, send)
+            return
+
+        capture = Capture(scope["method"], scope["path"])
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                capture.status = message["status"]
+                message = dict(message)
+                message["headers"] = list(message.get("headers", [])) + [(self.header, capture.id.encode())]
+            await send(message)
+
+        token = _current_capture.set(capture)
+        sampler = Sampler(capture, self.interval)
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            sampler.stop()
+            _current_capture.reset(token)
+            capture.elapsed = time.perf_counter() - capture.started
+            try:
+                await asyncio.to_thread(write_capture, capture)
+            except OSError as e:
+                print(f"Erro ao gravar o perfil {capture.id}: {e}")
@@ -0,0 +1,61 @@
+import threading
+from collections import deque
+from itertools import islice
+from typing import Dict, Iterable, List, Optional
+from decouple import config
+
+RECENT_READINGS = config('RECENT_READINGS', default=100, cast=int)
+
+
+class RecentReadings:
+    def __init__(self, size: int = RECENT_READINGS):
+        self.size = size
+        self.devices_data: Dict[str, deque] = {}
+        self.devices_data_lock = threading.Lock()
+        self._stored_connected: Dict[str, bool] = {}
+        # Desligado quando o processo não recebe as leituras (API sem ingestão);
+        # nesse caso /latest e /recent consultam o banco.
+        self.enabled = True
+
+    def append(self, reading: Dict):
+        with self.devices_data_lock:
+            buffer = self.devices_data.get(reading["device_id"])
+            if buffer is None:
+                buffer = self.devices_data[reading["device_id"]] = deque(maxlen=self.size)
+            buffer.append(reading)
+
+    def extend(self, readings: List[Dict]):
+        with self.devices_data_lock:
+            for reading in readings:
+                buffer = self.devices_data.get(reading["device_id"])
+                if buffer is None:
+                    buffer = self.devices_data[reading["device_id"]] = deque(maxlen=self.size)
+                buffer.append(reading)
+
+    def get(self, device_id: str, n: int) -> Optional[List[Dict]]:
+        with self.devices_data_lock:
+            if not self.enabled or device_id not in self._stored_connected:
+                return None
+            buffer = self.devices_data.get(device_id, ())
+            return list(islice(reversed(buffer), n))
+
+    def stored_connected(self, device_id: str) -> bool:
+        return self._stored_connected.get(device_id, False)
+
+    def warm(self, device_id: str, readings: Iterable[Dict], connected: bool):
+        with self.devices_data_lock:
+            merged = {reading["id"]: reading for reading in readings}
+            for reading in self.devices_data.get(device_id, ()):
+                merged[reading["id"]] = reading
+            ordered = sorted(merged.values(), key=lambda r: r["timestamp"])
+            self.devices_data[device_id] = deque(ordered, maxlen=self.size)
+            self._stored_connected[device_id] = connected
+
+    def forget(self, device_ids: Iterable[str]):
+        with self.devices_data_lock:
+            for device_id in device_ids:
+                self.devices_data.pop(device_id, None)
+                self._stored_connected.pop(device_id, None)
+
+
+recent_readings = RecentReadings()
@@ -0,0 +1,100 @@
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+from decouple import config
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from app.db.models import DeviceRollupModel
+
+ROLLUP_MAX_GAP = config('ROLLUP_MAX_GAP', default=60, cast=int)
+
+RESOLUTIONS = {"1m": 60, "1h": 3600, "1d": 86400}
+
+
+def bucket_start(moment: datetime, seconds: int) -> datetime:
+    epoch = int(moment.timestamp())
+    return datetime.fromtimestamp(epoch - epoch % seconds, tz=timezone.utc)
+
+
+class RollupAggregator:
+    def __init__(self, max_gap: float = ROLLUP_MAX_GAP):
+        self.max_gap = max_gap
+        self._lock = threading.Lock()
+        self._previous: Dict[str, datetime] = {}
+
+    def checkpoint(self, device_ids: Iterable[str]) -> Dict[str, Optional[datetime]]:
+        with self._lock:
+            return {device_id: self._previous.get(device_id) for device_id in device_ids}
+
+    def restore(self, checkpoint: Dict[str, Optional[datetime]]):
+        with self._lock:
+            for device_id, previous in checkpoint.items():
+                if previous is None:
+                    self._previous.pop(device_id, None)
+                else:
+                    self._previous[device_id] = previous
+
+    def aggregate(self, rows: List[Dict]) -> List[Dict]:
+        buckets: Dict[tuple, Dict] = {}
+        with self._lock:
+            for row in sorted(rows, key=lambda r: (r["device_id"], r["timestamp"])):
+                device_id, moment = row["device_id"], row["timestamp"]
+                corrente, tensao = float(row["corrente"]), float(row["tensao"])
+                potencia = corrente * tensao
+
+                previous = self._previous.get(device_id)
+                elapsed = (moment - previous).total_seconds() if previous else 0.0
+                energia_wh = potencia * min(max(elapsed, 0.0), self.max_gap) / 3600
+                if previous is None or moment > previous:
+                    self._previous[device_id] = moment
+
+                for resolution, seconds in RESOLUTIONS.items():
+                    key = (device_id, resolution, bucket_start(moment, seconds))
+                    bucket = buckets.get(key)
+                    if bucket is None:
+                        buckets[key] = {
+                            "device_id": device_id,
+                            "resolution": resolution,
+                            "bucket": key[2],
+                            "samples": 1,
+                            "corrente_min": corrente,
+                            "corrente_max": corrente,
+                            "corrente_sum": corrente,
+                            "tensao_sum": tensao,
+                            "potencia_sum": potencia,
+                            "energia_wh": energia_wh,
+                        }
+                        continue
+                    bucket["samples"] += 1
+                    bucket["corrente_min"] = min(bucket["corrente_min"], corrente)
+                    bucket["corrente_max"] = max(bucket["corrente_max"], corrente)
+                    bucket["corrente_sum"] += corrente
+                    bucket["tensao_sum"] += tensao
+                    bucket["potencia_sum"] += potencia
+                    bucket["energia_wh"] += energia_wh
+        return list(buckets.values())
+
+    def apply(self, db: Session, rows: List[Dict]):
+        buckets = self.aggregate(rows)
+        if not buckets:
+            return
+        statement = insert(DeviceRollupModel).values(buckets)
+        table = DeviceRollupModel.__table__
+        db.execute(
+            statement.on_conflict_do_update(
+                index_elements=[table.c.device_id, table.c.resolution, table.c.bucket],
+                set_={
+                    "samples": table.c.samples + statement.excluded.samples,
+                    "corrente_min": func.least(table.c.corrente_min, statement.excluded.corrente_min),
+                    "corrente_max": func.greatest(table.c.corrente_max, statement.excluded.corrente_max),
+                    "corrente_sum": table.c.corrente_sum + statement.excluded.corrente_sum,
+                    "tensao_sum": table.c.tensao_sum + statement.excluded.tensao_sum,
+                    "potencia_sum": table.c.potencia_sum + statement.excluded.potencia_sum,
+                    "energia_wh": table.c.energia_wh + statement.excluded.energia_wh,
+                },
+            )
+        )
+
+
+rollups = RollupAggregator()
@@ -0,0 +1,234 @@
+import itertools
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+from decouple import config
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+SPOOL_DIR = config('SPOOL_DIR', default="spool")
+SPOOL_SEGMENT_BYTES = config('SPOOL_SEGMENT_BYTES', default=16 * 1024 * 1024, cast=int)
+SPOOL_MAX_BYTES = config('SPOOL_MAX_BYTES', default=1024 * 1024 * 1024, cast=int)
+SPOOL_RETRY_INTERVAL = config('SPOOL_RETRY_INTERVAL', default=5, cast=float)
+SPOOL_REPLAY_BUDGET = config('SPOOL_REPLAY_BUDGET', default=1, cast=float)
+
+SEGMENT_SUFFIX = ".ndjson"
+LOCK_FILE = ".lock"
+
+
+def _try_lock(handle) -> bool:
+    # O lock some junto com o processo, então um diretório deixado por um
+    # worker que caiu fica livre para o próximo que subir.
+    try:
+        if fcntl is not None:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def encode_reading(reading: Dict) -> bytes:
+    return (json.dumps({
+        "id": reading["id"],
+        "device_id": reading["device_id"],
+        "corrente": reading["corrente"],
+        "tensao": reading["tensao"],
+        "timestamp": reading["timestamp"].isoformat(),
+    }) + "\n").encode()
+
+
+def decode_reading(line: bytes) -> Dict:
+    reading = json.loads(line)
+    reading["timestamp"] = datetime.fromisoformat(reading["timestamp"])
+    return reading
+
+
+class Spool:
+    # Leituras que não puderam ir para o banco ficam em segmentos NDJSON só de
+    # acréscimo, nomeados pelo horário de criação. Cada lote é gravado com um
+    # único fsync. A leitura avança pelo segmento mais antigo e ele é apagado
+    # quando termina. O ponto de leitura fica só em memória: depois de uma
+    # queda o segmento é relido do início e o ON CONFLICT do gravador descarta
+    # o que já tinha entrado.
+    def __init__(self, segment_bytes: int = SPOOL_SEGMENT_BYTES, max_bytes: int = SPOOL_MAX_BYTES):
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.directory: Optional[str] = None
+        self.spooled = 0
+        self.replayed = 0
+        self.discarded_bytes = 0
+        self._segments: List[str] = []
+        self._writer = None
+        self._reader = None
+        self._read_start = 0
+        self._lock = threading.RLock()
+        self._lock_handle = None
+
+    def claim(self, directory: str) -> str:
+        # Processos com o mesmo nome (workers do Uvicorn) ficam cada um com o
+        # primeiro diretório livre: <nome>, <nome>-1, <nome>-2...
+        for index in itertools.count():
+            candidate = directory if index == 0 else f"{directory}-{index}"
+            if self.open(candidate):
+                return candidate
+
+    def open(self, directory: str) -> bool:
+        os.makedirs(directory, exist_ok=True)
+        handle = open(os.path.join(directory, LOCK_FILE), "a+b")
+        if not _try_lock(handle):
+            handle.close()
+            return False
+        self._lock_handle = handle
+        self.directory = directory
+        self._segments = sorted(
+            os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX)
+        )
+        if self._segments:
+            print(f"Spool com {len(self._segments)} segmentos pendentes em {directory}")
+        return True
+
+    def close(self):
+        with self._lock:
+            for handle in (self._writer, self._reader, self._lock_handle):
+                if handle is not None:
+                    handle.close()
+            self._writer = self._reader = self._lock_handle = None
+
+    def pending(self) -> bool:
+        return bool(self._segments)
+
+    def append(self, readings: List[Dict]):
+        data = b"".join(encode_reading(reading) for reading in readings)
+        with self._lock:
+            if self._writer is None or self._writer.tell() >= self.segment_bytes:
+                self._rotate()
+            try:
+                self._writer.write(data)
+                self._writer.flush()
+                os.fsync(self._writer.fileno())
+            except OSError:
+                # Uma linha pela metade fica no fim deste segmento, que é
+                # encerrado; a leitura descarta esse resto.
+                self._writer.close()
+                self._writer = None
+                raise
+            self.spooled += len(readings)
+            self._enforce_limit()
+
+    def _rotate(self):
+        if self._writer is not None:
+            self._writer.close()
+        path = os.path.join(self.directory, f"{time.time_ns():020d}{SEGMENT_SUFFIX}")
+        self._writer = open(path, "ab")
+        self._segments.append(path)
+
+    def _enforce_limit(self):
+        # Com o limite estourado o segmento mais antigo é descartado inteiro; o
+        # segmento em escrita nunca é apagado.
+        while len(self._segments) > 1 and self.size() > self.max_bytes:
+            path = self._segments[0]
+            discarded = os.path.getsize(path) - (self._reader.tell() if self._reader is not None else 0)
+            self._drop_oldest()
+            self.discarded_bytes += discarded
+            print(f"Spool acima de {self.max_bytes} bytes: segmento {os.path.basename(path)} descartado")
+
+    def read(self, limit: int) -> List[Dict]:
+        # Cada leitura fica num só segmento; um segmento só é apagado quando uma
+        # leitura posterior encontra o fim dele, ou seja, depois do commit.
+        with self._lock:
+            return self._read(limit)
+
+    def _read(self, limit: int) -> List[Dict]:
+        while self._segments:
+            if self._reader is None:
+                self._reader = open(self._segments[0], "rb")
+            self._read_start = self._reader.tell()
+            readings: List[Dict] = []
+            while len(readings) < limit:
+                line = self._reader.readline()
+                if line.endswith(b"\n"):
+                    try:
+                        readings.append(decode_reading(line))
+                    except (ValueError, KeyError) as e:
+                        print(f"Registro inválido no spool ignorado: {e}")
+                    continue
+                if self._is_writing(self._segments[0]):
+                    # Fim do segmento em escrita: volta ao início da linha e
+                    # espera o próximo acréscimo.
+                    self._reader.seek(-len(line), os.SEEK_CUR)
+                    return readings
+                if readings:
+                    return readings
+                # Fim de um segmento encerrado (uma linha incompleta no final é
+                # resto de uma gravação interrompida).
+                self._drop_oldest()
+                break
+            else:
+                return readings
+        return []
+
+    def commit(self, count: int):
+        # Chamado depois que o lote lido foi gravado. Um segmento em escrita que
+        # foi consumido por inteiro é encerrado para não crescer para sempre.
+        with self._lock:
+            self.replayed += count
+            if (
+                len(self._segments) == 1
+                and self._reader is not None
+                and self._is_writing(self._segments[0])
+                and self._reader.tell() == self._writer.tell()
+            ):
+                self._drop_oldest()
+
+    def rewind(self):
+        # Devolve o último lote lido, que não pôde ser gravado: ele será lido de novo.
+        with self._lock:
+            if self._reader is not None:
+                self._reader.seek(self._read_start)
+
+    def _is_writing(self, path: str) -> bool:
+        return self._writer is not None and self._writer.name == path
+
+    def _drop_oldest(self):
+        path = self._segments.pop(0)
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        if self._is_writing(path):
+            self._writer.close()
+            self._writer = None
+        os.remove(path)
+
+    def size(self) -> int:
+        with self._lock:
+            total = sum(os.path.getsize(path) for path in self._segments)
+            if self._reader is not None:
+                total -= self._reader.tell()
+            return total
+
+    def oldest_age(self) -> Optional[float]:
+        with self._lock:
+            if not self._segments:
+                return None
+            created = int(os.path.basename(self._segments[0])[:-len(SEGMENT_SUFFIX)]) / 1e9
+        return max(time.time() - created, 0.0)
+
+    def status(self) -> Dict:
+        return {
+            "directory": self.directory,
+            "segments": len(self._segments),
+            "pending_bytes": self.size(),
+            "oldest_age_seconds": self.oldest_age(),
+            "spooled": self.spooled,
+            "replayed": self.replayed,
+            "discarded_bytes": self.discarded_bytes,
+        }
@@ -1,14 +1,16 @@
+import asyncio
 from datetime import datetime, timedelta, timezone
 from fastapi import status
 from fastapi.exceptions import HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import select
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.errors import is_foreign_key_violation
 from app.db.models import UserModel
 from app.schemas import LoginResponse, User, UserUpdate
 from decouple import config
 from jose import jwt
 from passlib.context import CryptContext
-from psycopg2.errors import ForeignKeyViolation
 
 
 SECRET_KEY = config('SECRET_KEY')
@@ -16,23 +18,23 @@ ALGORITHM = config('ALGORITHM')
 crypt_context = CryptContext(schemes=["sha256_crypt"])
 
 class UsersService:
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
 
-    def create_user(self, user: User) -> User:
+    async def create_user(self, user: User) -> User:
         db_user = UserModel(
             email=user.email,
             full_name=user.full_name,
-            password=self.get_password_hash(user.password),
+            password=await self.get_password_hash(user.password),
             community_id=user.community_id,
             is_manager=user.is_manager or False
         )
         try:
             self.db.add(db_user)
-            self.db.commit()
-            self.db.refresh(db_user)
+            await self.db.commit()
+            await self.db.refresh(db_user)
         except IntegrityError as e:
-            if isinstance(e.orig, ForeignKeyViolation):
+            if is_foreign_key_violation(e):
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="Comunidade associada ao usuário não existe"
@@ -47,23 +49,23 @@ class UsersService:
                 detail=str(e)
             )
     
-    def login_user(self, email: str, password: str, expires_in: int = 1440) -> LoginResponse:
-        user = self.get_user_by_email(email)
+    async def login_user(self, email: str, password: str, expires_in: int = 1440) -> LoginResponse:
+        user = await self.get_user_by_email(email)
         if not user:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Email ou senha inválidos")
-        if not self.verify_password(password, user.password):
+        if not await self.verify_password(password, user.password):
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Email ou senha inválidos")
         
         access_token = self.create_access_token(data={"sub": user.email}, expires_in=expires_in)
         return {"access_token": access_token[0], "expires_in": access_token[1]}
 
-    def verify_token(self, token: str):
+    async def verify_token(self, token: str):
         try:
             data = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         except jwt.JWTError:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token inválido")
         
-        user = self.get_user_by_email(data.get("sub"))
+        user = await self.get_user_by_email(data.get("sub"))
         if user is None:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token inválido")
         
@@ -74,30 +76,32 @@ class UsersService:
         encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
         return [encoded_jwt, exp.isoformat()]
 
-    def get_user_by_email(self, email: str) -> User:
-        return self.db.query(UserModel).filter(UserModel.email == email).first()
+    async def get_user_by_email(self, email: str) -> User:
+        return await self.db.scalar(select(UserModel).where(UserModel.email == email))
     
-    def get_user_by_id(self, user_id: int) -> User:
-        return self.db.query(UserModel).filter(UserModel.id == user_id).first()
+    async def get_user_by_id(self, user_id: int) -> User:
+        return await self.db.get(UserModel, user_id)
     
-    def get_users(self) -> list[User]:
-        return self.db.query(UserModel).all()
+    async def get_users(self) -> list[User]:
+        return (await self.db.scalars(select(UserModel))).all()
 
-    def verify_password(self, plain_password: str, hashed_password: str) -> bool:
-        return crypt_context.verify(plain_password, hashed_password)
+    # O hash sha256_crypt custa centenas de milissegundos de CPU; roda fora do
+    # event loop para não travar as outras requisições.
+    async def verify_password(self, plain_password: str, hashed_password: str) -> bool:
+        return await asyncio.to_thread(crypt_context.verify, plain_password, hashed_password)
 
-    def get_password_hash(self, password: str) -> str:
-        return crypt_context.hash(password)
+    async def get_password_hash(self, password: str) -> str:
+        return await asyncio.to_thread(crypt_context.hash, password)
     
-    def delete_user(self, id: str):
-        user = self.get_user_by_id(id)
+    async def delete_user(self, id: int):
+        user = await self.get_user_by_id(id)
         if not user:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Usuário não encontrado")
-        self.db.delete(user)
-        self.db.commit()
+        await self.db.delete(user)
+        await self.db.commit()
     
-    def update_user(self, id: str, user_update: UserUpdate) -> User:
-        db_user = self.get_user_by_id(id)
+    async def update_user(self, id: int, user_update: UserUpdate) -> User:
+        db_user = await self.get_user_by_id(id)
         if not db_user:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Usuário não encontrado")
 
@@ -106,17 +110,17 @@ class UsersService:
         if user_update.full_name is not None:
             db_user.full_name = user_update.full_name
         if user_update.password is not None:
-            db_user.password = self.get_password_hash(user_update.password)
+            db_user.password = await self.get_password_hash(user_update.password)
         if user_update.community_id is not None:
             db_user.community_id = user_update.community_id
         if user_update.is_manager is not None:
             db_user.is_manager = user_update.is_manager
 
         try:
-            self.db.commit()
-            self.db.refresh(db_user)
+            await self.db.commit()
+            await self.db.refresh(db_user)
         except IntegrityError as e:
-            if isinstance(e.orig, ForeignKeyViolation):
+            if is_foreign_key_violation(e):
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="Comunidade associada ao usuário não existe"
@@ -0,0 +1,265 @@
+import argparse
+import asyncio
+import os
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+# Prefixo próprio para não colidir com a frota do benchmark de ingestão, que
+# apaga os dispositivos bench-* ao começar.
+PREFIX = "http-bench-"
+BENCH_PASSWORD = "benchmark"
+
+# Escalas prontas; --communities, --users, --devices e --readings sobrescrevem.
+PROFILES = {
+    "small": {"communities": 10, "users": 100, "devices": 1000, "readings": 100},
+    "medium": {"communities": 100, "users": 1000, "devices": 10000, "readings": 1000},
+    "large": {"communities": 1000, "users": 10000, "devices": 10000, "readings": 10000},
+}
+
+ROUTES = ("devices", "device_data", "device_latest", "community_search", "users_login", "users_token")
+
+
+def device_id(index: int) -> str:
+    return f"{PREFIX}{index:06d}"
+
+
+def user_email(index: int) -> str:
+    return f"{PREFIX}{index}@ohmni.local"
+
+
+def community_name(index: int) -> str:
+    return f"{PREFIX}{index}"
+
+
+def seed(engine, scale: Dict, span: timedelta, rows_per_statement: int = 1_000_000):
+    # Tudo é gerado no servidor com generate_series; do Python saem só os
+    # parâmetros. Reexecutar com a mesma escala não duplica nada.
+    from sqlalchemy import text
+    from app.db.partitions import floor_boundary, run_partition_maintenance
+    from app.utils.users import crypt_context
+
+    run_partition_maintenance(engine)
+    password = crypt_context.hash(BENCH_PASSWORD)
+    with engine.begin() as connection:
+        connection.execute(text("""
+            INSERT INTO communities (name)
+            SELECT :prefix || g FROM generate_series(0, :count - 1) g
+            ON CONFLICT DO NOTHING
+        """), {"prefix": PREFIX, "count": scale["communities"]})
+        connection.execute(text("""
+            INSERT INTO users (email, full_name, password, community_id, is_manager)
+            SELECT :prefix || g || '@ohmni.local', 'Benchmark ' || g, :password, c.id, false
+            FROM generate_series(0, :count - 1) g
+            JOIN communities c ON c.name = :prefix || (g % :communities)
+            ON CONFLICT DO NOTHING
+        """), {"prefix": PREFIX, "count": scale["users"], "communities": scale["communities"], "password": password})
+        connection.execute(text("""
+            INSERT INTO devices (id, name, owner, type, is_collective, connected, last_seen)
+            SELECT :prefix || lpad(g::text, 6, '0'), :prefix || lpad(g::text, 6, '0'), u.id, 'medidor', false, false, '0'
+            FROM generate_series(0, :count - 1) g
+            JOIN users u ON u.email = :prefix || (g % :users) || '@ohmni.local'
+            ON CONFLICT DO NOTHING
+        """), {"prefix": PREFIX, "count": scale["devices"], "users": scale["users"]})
+    print(f"{scale['communities']} comunidades, {scale['users']} usuários e {scale['devices']} dispositivos prontos")
+
+    readings = scale["readings"]
+    if not readings:
+        return
+    # As leituras ficam entre o início da partição atual e agora, para caber
+    # nas partições que a manutenção acabou de garantir.
+    end = datetime.now(timezone.utc)
+    start = max(floor_boundary(end), end - span)
+    step = (end - start).total_seconds() / readings
+    chunk = max(rows_per_statement // readings, 1)
+    started = time.monotonic()
+    for first in range(0, scale["devices"], chunk):
+        last = min(first + chunk, scale["devices"]) - 1
+        with engine.begin() as connection:
+            connection.execute(text("""
+                INSERT INTO device_data (id, device_id, corrente, tensao, timestamp)
+                SELECT d.id || '-b' || g, d.id, 1 + (g % 10) / 10.0, 220 + (g % 7),
+                       to_timestamp(:end) - g * make_interval(secs => :step)
+                FROM devices d CROSS JOIN generate_series(0, :readings - 1) g
+                WHERE d.id BETWEEN :first AND :last
+                ON CONFLICT DO NOTHING
+            """), {
+                "end": end.timestamp(),
+                "step": step,
+                "readings": readings,
+                "first": device_id(first),
+                "last": device_id(last),
+            })
+        done = (last + 1) * readings
+        elapsed = time.monotonic() - started
+        print(f"{done} de {scale['devices'] * readings} leituras inseridas ({done / elapsed:.0f}/s)")
+    with engine.begin() as connection:
+        connection.exec_driver_sql("ANALYZE device_data")
+
+
+def drop(engine):
+    from sqlalchemy import delete
+    from app.db.models import CommunityModel, UserModel
+    from benchmarks.common import drop_fleet
+
+    drop_fleet(engine, PREFIX)
+    with engine.begin() as connection:
+        connection.execute(delete(UserModel).where(UserModel.email.like(f"{PREFIX}%")))
+        connection.execute(delete(CommunityModel).where(CommunityModel.name.like(f"{PREFIX}%")))
+
+
+def build_requests(scale: Dict, page_size: int, token: str) -> Dict[str, Callable]:
+    # Cada rota sorteia o alvo a cada requisição, espalhando a carga pelos
+    # dados semeados em vez de repetir sempre a mesma linha.
+    def pick(count: int) -> int:
+        return random.randrange(count)
+
+    return {
+        "devices": lambda client: client.get("/devices/"),
+        "device_data": lambda client: client.get(f"/devices/{device_id(pick(scale['devices']))}", params={"limit": page_size}),
+        "device_latest": lambda client: client.get(f"/devices/{device_id(pick(scale['devices']))}/latest"),
+        "community_search": lambda client: client.get(f"/community/search/{community_name(pick(scale['communities']))}"),
+        "users_login": lambda client: client.post(
+            "/users/login", data={"email": user_email(pick(scale["users"])), "password": BENCH_PASSWORD},
+        ),
+        "users_token": lambda client: client.post("/users/token", data={"token": token}),
+    }
+
+
+async def measure(client, request: Callable, concurrency: int, duration: float, warmup: int) -> Dict:
+    from benchmarks.common import percentiles
+
+    for _ in range(warmup):
+        await request(client)
+
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    errors: Dict[str, int] = {}
+    deadline = time.monotonic() + duration
+
+    async def worker():
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                response = await request(client)
+            except Exception as e:
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    started = time.monotonic()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.monotonic() - started
+    return {
+        "requests": len(latencies),
+        "elapsed_seconds": elapsed,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0,
+        "latency_seconds": percentiles(latencies),
+        "status_codes": {str(code): count for code, count in sorted(statuses.items())},
+        "errors": errors,
+    }
+
+
+async def drive(args, scale: Dict, routes: List[str]) -> Dict[str, Dict]:
+    import httpx
+    from app.db.connection import async_engine
+    from app.main import INGEST_IN_API, app
+    from app.utils.presence import presence
+    from app.utils.recent import recent_readings
+
+    # O lifespan não roda: sem MQTT nem gravador, só o caminho de leitura. O
+    # modo da API segue INGEST_IN_API, como no lifespan; com False o /latest
+    # sempre consulta o banco em vez do cache em memória.
+    if not INGEST_IN_API:
+        presence.tracking = False
+        recent_readings.enabled = False
+
+    transport = httpx.ASGITransport(app=app)
+    results: Dict[str, Dict] = {}
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            login = await client.post("/users/login", data={"email": user_email(0), "password": BENCH_PASSWORD})
+            login.raise_for_status()
+            requests = build_requests(scale, args.page_size, login.json()["access_token"])
+            for route in routes:
+                print(f"Medindo {route} com {args.concurrency} clientes por {args.duration:g}s")
+                results[route] = await measure(client, requests[route], args.concurrency, args.duration, args.warmup)
+                latency = results[route]["latency_seconds"]
+                print(
+                    f"  {results[route]['requests']} requisições, {results[route]['throughput_rps']:.0f}/s, "
+                    f"p50 {latency['p50']}s, p99 {latency['p99']}s, status {results[route]['status_codes']}"
+                )
+    finally:
+        await async_engine.dispose()
+    return results
+
+
+def run(args) -> Dict:
+    from app.db.connection import engine
+    from app.main import INGEST_IN_API
+    from benchmarks.common import rss_mb
+
+    scale = dict(PROFILES[args.profile])
+    for key in scale:
+        if getattr(args, key) is not None:
+            scale[key] = getattr(args, key)
+    routes = args.routes or list(ROUTES)
+
+    if args.skip_seed:
+        print("Usando os dados já semeados")
+    else:
+        seed(engine, scale, timedelta(days=args.span_days))
+
+    rss_start = rss_mb()
+    try:
+        per_route = asyncio.run(drive(args, scale, routes))
+    finally:
+        if not args.keep:
+            drop(engine)
+
+    return {
+        "config": {
+            "profile": args.profile,
+            **scale,
+            "concurrency": args.concurrency,
+            "duration_per_route": args.duration,
+            "page_size": args.page_size,
+            "ingest_in_api": INGEST_IN_API,
+        },
+        "routes": per_route,
+        "memory": {"rss_start_mb": rss_start, "rss_peak_mb": rss_mb()},
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark das rotas de leitura da API sobre dados semeados.")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="small", help="escala dos dados semeados (small)")
+    parser.add_argument("--communities", type=int, help="comunidades (sobrescreve o perfil)")
+    parser.add_argument("--users", type=int, help="usuários (sobrescreve o perfil)")
+    parser.add_argument("--devices", type=int, help="dispositivos (sobrescreve o perfil)")
+    parser.add_argument("--readings", type=int, help="leituras por dispositivo (sobrescreve o perfil)")
+    parser.add_argument("--span-days", type=float, default=7, help="janela das leituras semeadas, limitada à partição atual (7)")
+    parser.add_argument("--routes", nargs="+", choices=ROUTES, help="rotas medidas (todas)")
+    parser.add_argument("--concurrency", type=int, default=32, help="clientes simultâneos (32)")
+    parser.add_argument("--duration", type=float, default=20.0, help="segundos medindo cada rota (20)")
+    parser.add_argument("--warmup", type=int, default=20, help="requisições descartadas antes de medir cada rota (20)")
+    parser.add_argument("--page-size", type=int, default=100, help="limit usado em /devices/{id} (100)")
+    parser.add_argument("--db-url", help="banco usado no lugar de DB_URL; use um banco descartável com as migrações aplicadas")
+    parser.add_argument("--output", help="diretório dos resultados (benchmarks/results)")
+    parser.add_argument("--skip-seed", action="store_true", help="reaproveita os dados de uma execução com --keep")
+    parser.add_argument("--keep", action="store_true", help="mantém os dados semeados no banco")
+    args = parser.parse_args(argv)
+
+    if args.db_url:
+        os.environ["DB_URL"] = args.db_url
+    from benchmarks.common import RESULTS_DIR, save_results
+
+    results = run(args)
+    path = save_results("api", results, args.output or RESULTS_DIR)
+    print(f"Resultados salvos em {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import json
+import os
+import platform
+import resource
+import subprocess
+import time
+from typing import Dict, List, Optional, Sequence
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+BENCH_COMMUNITY = "benchmark"
+BENCH_USER_EMAIL = "benchmark@ohmni.local"
+
+
+def percentiles(values: Sequence[float], points: Sequence[float] = (50, 90, 99)) -> Dict[str, Optional[float]]:
+    if not values:
+        return {**{f"p{point:g}": None for point in points}, "max": None, "mean": None}
+    ordered = sorted(values)
+    result = {
+        f"p{point:g}": ordered[min(int(len(ordered) * point / 100), len(ordered) - 1)]
+        for point in points
+    }
+    result["max"] = ordered[-1]
+    result["mean"] = sum(ordered) / len(ordered)
+    return result
+
+
+def rss_mb() -> float:
+    # ru_maxrss vem em KB no Linux e em bytes no macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if platform.system() == "Darwin" else peak / 1024
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True, cwd=os.path.dirname(__file__),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(name: str, results: Dict, directory: str = RESULTS_DIR) -> str:
+    os.makedirs(directory, exist_ok=True)
+    results = {
+        "benchmark": name,
+        "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        **results,
+    }
+    path = os.path.join(directory, f"{name}-{time.strftime('%Y%m%dT%H%M%S')}.json")
+    with open(path, "w") as handle:
+        json.dump(results, handle, indent=2, default=str)
+    return path
+
+
+def seed_fleet(engine, device_ids: List[str], device_type: str = "medidor"):
+    # Cria a comunidade, o usuário e os dispositivos usados pelos benchmarks; as
+    # importações ficam aqui porque DB_URL pode ter sido trocado pela linha de comando.
+    from sqlalchemy import select
+    from sqlalchemy.dialects.postgresql import insert
+    from app.db.models import CommunityModel, DeviceModel, UserModel
+    from app.db.partitions import run_partition_maintenance
+
+    run_partition_maintenance(engine)
+    with engine.begin() as connection:
+        connection.execute(insert(CommunityModel).values(name=BENCH_COMMUNITY).on_conflict_do_nothing())
+        community_id = connection.scalar(select(CommunityModel.id).where(CommunityModel.name == BENCH_COMMUNITY))
+        connection.execute(insert(UserModel).values(
+            email=BENCH_USER_EMAIL, full_name="Benchmark", password="!", community_id=community_id,
+        ).on_conflict_do_nothing())
+        owner = connection.scalar(select(UserModel.id).where(UserModel.email == BENCH_USER_EMAIL))
+        for start in range(0, len(device_ids), 1000):
+            connection.execute(insert(DeviceModel).values([
+                {"id": device_id, "name": device_id, "owner": owner, "type": device_type, "last_seen": "0"}
+                for device_id in device_ids[start:start + 1000]
+            ]).on_conflict_do_nothing())
+    return community_id
+
+
+def drop_fleet(engine, prefix: str):
+    from sqlalchemy import delete
+    from app.db.models import DeviceDataModel, DeviceModel, DeviceRollupModel
+
+    with engine.begin() as connection:
+        for model in (DeviceDataModel, DeviceRollupModel):
+            connection.execute(delete(model).where(model.device_id.like(f"{prefix}%")))
+        connection.execute(delete(DeviceModel).where(DeviceModel.id.like(f"{prefix}%")))
@@ -0,0 +1,212 @@
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+FLEET_PREFIX = "bench-"
+
+
+class Message:
+    def __init__(self, topic: str, payload: bytes):
+        self.topic = topic
+        self.payload = payload
+        self.properties = None
+
+
+class LocalBroker:
+    # Substitui o broker e a thread de rede do paho: uma única thread entrega as
+    # mensagens ao handler na ordem de publicação, como o loop do cliente MQTT.
+    # A fila limitada faz o papel do TCP: se o handler não acompanha, quem
+    # publica espera.
+    def __init__(self, handler: Callable[[Message], None], maxsize: int = 10000):
+        self.handler = handler
+        self.delivered = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=maxsize)
+        self._thread = threading.Thread(target=self._run, name="local-broker", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def publish(self, topic: str, payload: bytes):
+        self._queue.put(Message(topic, payload))
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            message = self._queue.get()
+            if message is None:
+                return
+            self.handler(message)
+            self.delivered += 1
+
+
+class VirtualFleet:
+    # Cada medidor gera `rate` leituras por segundo e as envia em mensagens de
+    # `per_message` leituras, em JSON (uma leitura por mensagem, com seq e
+    # timestamp) ou no formato binário v1.
+    def __init__(self, device_ids: List[str], rate: float, per_message: int, payload_format: str):
+        self.device_ids = device_ids
+        self.rate = rate
+        self.per_message = per_message if payload_format == "binary" else 1
+        self.payload_format = payload_format
+        self.published_messages = 0
+        self.published_readings = 0
+        self._seq: Dict[str, int] = {device_id: 0 for device_id in device_ids}
+
+    def connect_all(self, broker: LocalBroker):
+        for device_id in self.device_ids:
+            broker.publish(f"iot/{device_id}/connect", b"conectado")
+
+    def _payload(self, device_id: str, now: float) -> bytes:
+        from app.utils.payloads import encode_binary_v1
+
+        if self.payload_format == "binary":
+            # As leituras de uma mensagem ficam 10 µs uma da outra em vez de
+            # espaçadas por 1/rate: assim a latência medida é a da ingestão, e
+            # não o tempo que o medidor as guardaria antes de enviar.
+            return encode_binary_v1([
+                (now + index * 0.00001, 1.0 + index % 10 / 10, 220.0)
+                for index in range(self.per_message)
+            ])
+        self._seq[device_id] += 1
+        return json.dumps({
+            "id": device_id,
+            "seq": self._seq[device_id],
+            "timestamp": now,
+            "corrente": 1.5,
+            "tensao": 220.0,
+        }).encode()
+
+    def run(self, broker: LocalBroker, duration: float):
+        # Mensagens por segundo da frota inteira; com rate 0 publica o mais rápido
+        # que o broker aceitar.
+        message_rate = len(self.device_ids) * self.rate / self.per_message
+        start = time.monotonic()
+        index = 0
+        while True:
+            elapsed = time.monotonic() - start
+            if elapsed >= duration:
+                return
+            due = int(elapsed * message_rate) if message_rate > 0 else self.published_messages + len(self.device_ids)
+            if self.published_messages >= due:
+                time.sleep(0.001)
+                continue
+            now = time.time()
+            while self.published_messages < due:
+                device_id = self.device_ids[index % len(self.device_ids)]
+                index += 1
+                broker.publish(f"iot/{device_id}/data", self._payload(device_id, now))
+                self.published_messages += 1
+                self.published_readings += self.per_message
+
+
+def run(args) -> Dict:
+    from app.db.connection import engine
+    from app.utils import mqtt_client
+    from app.utils.ingest import IngestWriter
+    from app.utils.metrics import ingest_readings, mqtt_decode_failures
+    from app.utils.presence import presence
+    from benchmarks.common import drop_fleet, percentiles, rss_mb, seed_fleet
+
+    latencies: List[float] = []
+
+    class MeasuredWriter(IngestWriter):
+        # Latência de ingestão até o commit: do horário de cada leitura (definido
+        # pela frota ao publicar) até o fim da transação do lote.
+        def _write(self, batch: List[Dict], source: str = "live"):
+            super()._write(batch, source)
+            committed = time.time()
+            latencies.extend(committed - reading["timestamp"].timestamp() for reading in batch)
+
+    device_ids = [f"{FLEET_PREFIX}{index:06d}" for index in range(args.devices)]
+    print(f"Preparando {len(device_ids)} dispositivos virtuais")
+    drop_fleet(engine, FLEET_PREFIX)
+    seed_fleet(engine, device_ids)
+    for device_id in device_ids:
+        presence.set_device_type(device_id, "medidor")
+
+    writer = MeasuredWriter()
+    mqtt_client.ingest_writer = writer
+    mqtt_client.ingest_enabled = True
+    writer.start("benchmark")
+    broker = LocalBroker(mqtt_client.on_message_handler)
+    broker.start()
+    fleet = VirtualFleet(device_ids, args.rate, args.per_message, args.format)
+
+    rss_start = rss_mb()
+    stored_before = ingest_readings.total("stored")
+    started = time.monotonic()
+    fleet.connect_all(broker)
+    fleet.run(broker, args.duration)
+    published = time.monotonic() - started
+    broker.close()
+    writer.stop(timeout=args.drain_timeout)
+    elapsed = time.monotonic() - started
+    stored = ingest_readings.total("stored") - stored_before
+    status = writer.status()
+
+    results = {
+        "config": {
+            "devices": args.devices,
+            "rate_per_device": args.rate,
+            "readings_per_message": fleet.per_message,
+            "format": args.format,
+            "duration": args.duration,
+            "batch_size": writer.batch_size,
+            "linger_seconds": writer.linger,
+            "queue_capacity": status["capacity"],
+            "overflow_policy": status["policy"],
+        },
+        "published_messages": fleet.published_messages,
+        "published_readings": fleet.published_readings,
+        "offered_rps": fleet.published_readings / published if published else 0,
+        "stored_readings": stored,
+        "duplicate_readings": ingest_readings.total("duplicate"),
+        "dropped_readings": status["dropped"],
+        "decode_failures": mqtt_decode_failures.total("data"),
+        "elapsed_seconds": elapsed,
+        "throughput_rps": stored / elapsed if elapsed else 0,
+        "latency_seconds": percentiles(latencies),
+        "memory": {"rss_start_mb": rss_start, "rss_peak_mb": rss_mb()},
+    }
+    if not args.keep:
+        drop_fleet(engine, FLEET_PREFIX)
+    return results
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark da ingestão MQTT -> Postgres com uma frota virtual.")
+    parser.add_argument("--devices", type=int, default=1000, help="medidores virtuais (1000)")
+    parser.add_argument("--rate", type=float, default=1.0, help="leituras por segundo de cada medidor; 0 publica sem limite (1)")
+    parser.add_argument("--duration", type=float, default=30.0, help="segundos publicando (30)")
+    parser.add_argument("--format", choices=("json", "binary"), default="json", help="formato do payload (json)")
+    parser.add_argument("--per-message", type=int, default=10, help="leituras por mensagem no formato binário (10)")
+    parser.add_argument("--drain-timeout", type=float, default=120.0, help="espera máxima para gravar a fila ao final (120)")
+    parser.add_argument("--db-url", help="banco usado no lugar de DB_URL; use um banco descartável com as migrações aplicadas")
+    parser.add_argument("--output", help="diretório dos resultados (benchmarks/results)")
+    parser.add_argument("--keep", action="store_true", help="mantém dispositivos e leituras do benchmark no banco")
+    args = parser.parse_args(argv)
+
+    if args.db_url:
+        os.environ["DB_URL"] = args.db_url
+    from benchmarks.common import RESULTS_DIR, save_results
+
+    results = run(args)
+    path = save_results("ingest", results, args.output or RESULTS_DIR)
+    latency = results["latency_seconds"]
+    print(
+        f"{results['stored_readings']} leituras gravadas em {results['elapsed_seconds']:.1f}s: "
+        f"{results['throughput_rps']:.0f} leituras/s, p50 {latency['p50']}s, p99 {latency['p99']}s, "
+        f"pico de memória {results['memory']['rss_peak_mb']:.0f} MB"
+    )
+    print(f"Resultados salvos em {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""typed device data columns
+
+Revision ID: b7c41e9a2f03
+Revises: 419284ad43c2
+Create Date: 2026-10-18 10:12:41.503118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7c41e9a2f03'
+down_revision: Union[str, None] = '419284ad43c2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BACKFILL_CHUNK_SIZE = 10000
+
+
+def upgrade() -> None:
+    # As colunas tipadas são criadas ao lado das antigas e preenchidas em lotes
+    # pequenos (cada lote em sua própria transação), para que a migração rode com
+    # a tabela em uso. Um trigger mantém as linhas novas preenchidas enquanto isso.
+    op.add_column('device_data', sa.Column('corrente_num', sa.Float(), nullable=True))
+    op.add_column('device_data', sa.Column('tensao_num', sa.Float(), nullable=True))
+    op.add_column('device_data', sa.Column('timestamp_tz', sa.DateTime(timezone=True), nullable=True))
+    op.execute("""
+        CREATE FUNCTION device_data_typed_sync() RETURNS trigger AS $$
+        BEGIN
+            NEW.corrente_num := NEW.corrente::double precision;
+            NEW.tensao_num := NEW.tensao::double precision;
+            NEW.timestamp_tz := NEW."timestamp"::timestamptz;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER device_data_typed_sync
+        BEFORE INSERT OR UPDATE OF corrente, tensao, "timestamp" ON device_data
+        FOR EACH ROW EXECUTE FUNCTION device_data_typed_sync()
+    """)
+
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+        last_id = ''
+        while True:
+            last_id = connection.execute(
+                sa.text("""
+                    WITH chunk AS (
+                        SELECT id FROM device_data WHERE id > :last_id ORDER BY id LIMIT :chunk_size
+                    ), backfilled AS (
+                        UPDATE device_data
+                        SET corrente_num = device_data.corrente::double precision,
+                            tensao_num = device_data.tensao::double precision,
+                            timestamp_tz = device_data."timestamp"::timestamptz
+                        FROM chunk
+                        WHERE device_data.id = chunk.id
+                        RETURNING device_data.id
+                    )
+                    SELECT max(id) FROM backfilled
+                """),
+                {"last_id": last_id, "chunk_size": BACKFILL_CHUNK_SIZE},
+            ).scalar()
+            if last_id is None:
+                break
+
+        # Constraints validadas permitem o SET NOT NULL abaixo sem varrer a tabela.
+        for column in ('corrente_num', 'tensao_num', 'timestamp_tz'):
+            op.execute(f'ALTER TABLE device_data ADD CONSTRAINT {column}_not_null CHECK ({column} IS NOT NULL) NOT VALID')
+            op.execute(f'ALTER TABLE device_data VALIDATE CONSTRAINT {column}_not_null')
+
+    op.execute('DROP TRIGGER device_data_typed_sync ON device_data')
+    op.execute('DROP FUNCTION device_data_typed_sync()')
+    for old_column, new_column in (('corrente', 'corrente_num'), ('tensao', 'tensao_num'), ('timestamp', 'timestamp_tz')):
+        op.alter_column('device_data', new_column, nullable=False)
+        op.drop_constraint(f'{new_column}_not_null', 'device_data', type_='check')
+        op.drop_column('device_data', old_column)
+        op.alter_column('device_data', new_column, new_column_name=old_column)
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_device_data_device_id_timestamp',
+            'device_data',
+            ['device_id', sa.text('"timestamp" DESC')],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_device_data_device_id_timestamp', table_name='device_data')
+    op.alter_column('device_data', 'timestamp',
+               existing_type=sa.DateTime(timezone=True),
+               type_=sa.String(),
+               existing_nullable=False)
+    op.alter_column('device_data', 'tensao',
+               existing_type=sa.Float(),
+               type_=sa.String(),
+               existing_nullable=False)
+    op.alter_column('device_data', 'corrente',
+               existing_type=sa.Float(),
+               type_=sa.String(),
+               existing_nullable=False)
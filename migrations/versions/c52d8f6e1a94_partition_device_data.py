@@ -0,0 +1,82 @@
+"""partition device data by timestamp
+
+Revision ID: c52d8f6e1a94
+Revises: b7c41e9a2f03
+Create Date: 2026-10-18 11:02:17.288410
+
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.db.partitions import ensure_partitions
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c52d8f6e1a94'
+down_revision: Union[str, None] = 'b7c41e9a2f03'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # A tabela atual vira a primeira partição (de MINVALUE até amanhã). O índice
+    # único e a constraint validada antes da troca permitem o ATTACH sem varrer
+    # a tabela com lock exclusivo.
+    boundary = (datetime.now(timezone.utc) + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'device_data_legacy_id_timestamp_key',
+            'device_data',
+            ['id', 'timestamp'],
+            unique=True,
+            postgresql_concurrently=True,
+        )
+        op.execute(
+            'ALTER TABLE device_data ADD CONSTRAINT device_data_legacy_id_timestamp_key '
+            'UNIQUE USING INDEX device_data_legacy_id_timestamp_key'
+        )
+        op.execute(
+            f"ALTER TABLE device_data ADD CONSTRAINT device_data_legacy_range "
+            f"CHECK (\"timestamp\" < '{boundary.isoformat()}') NOT VALID"
+        )
+        op.execute('ALTER TABLE device_data VALIDATE CONSTRAINT device_data_legacy_range')
+
+    op.rename_table('device_data', 'device_data_legacy')
+    op.execute('ALTER INDEX ix_device_data_device_id_timestamp RENAME TO device_data_legacy_device_id_timestamp_idx')
+    op.execute('ALTER INDEX ix_device_data_id RENAME TO device_data_legacy_id_idx')
+    op.execute('ALTER TABLE device_data_legacy RENAME CONSTRAINT device_data_pkey TO device_data_legacy_pkey')
+    op.execute('ALTER TABLE device_data_legacy RENAME CONSTRAINT device_data_device_id_fkey TO device_data_legacy_device_id_fkey')
+
+    op.create_table(
+        'device_data',
+        sa.Column('id', sa.String(), nullable=False),
+        sa.Column('device_id', sa.String(), nullable=False),
+        sa.Column('corrente', sa.Float(), nullable=False),
+        sa.Column('tensao', sa.Float(), nullable=False),
+        sa.Column('timestamp', sa.DateTime(timezone=True), nullable=False),
+        sa.ForeignKeyConstraint(['device_id'], ['devices.id'], ),
+        sa.PrimaryKeyConstraint('id', 'timestamp'),
+        postgresql_partition_by='RANGE ("timestamp")',
+    )
+    op.create_index('ix_device_data_device_id_timestamp', 'device_data', ['device_id', sa.text('"timestamp" DESC')])
+    op.execute(
+        f"ALTER TABLE device_data ATTACH PARTITION device_data_legacy "
+        f"FOR VALUES FROM (MINVALUE) TO ('{boundary.isoformat()}')"
+    )
+    op.execute('ALTER TABLE device_data_legacy DROP CONSTRAINT device_data_legacy_range')
+    ensure_partitions(op.get_bind())
+
+
+def downgrade() -> None:
+    op.execute('CREATE TABLE device_data_unpartitioned (LIKE device_data INCLUDING DEFAULTS)')
+    op.execute('INSERT INTO device_data_unpartitioned SELECT * FROM device_data')
+    op.drop_table('device_data')
+    op.rename_table('device_data_unpartitioned', 'device_data')
+    op.create_primary_key('device_data_pkey', 'device_data', ['id'])
+    op.create_foreign_key('device_data_device_id_fkey', 'device_data', 'devices', ['device_id'], ['id'])
+    op.create_index('ix_device_data_id', 'device_data', ['id'])
+    op.create_index('ix_device_data_device_id_timestamp', 'device_data', ['device_id', sa.text('"timestamp" DESC')])
@@ -0,0 +1,39 @@
+"""add device rollups
+
+Revision ID: d91f3a7c5b26
+Revises: c52d8f6e1a94
+Create Date: 2026-10-18 13:40:05.117902
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd91f3a7c5b26'
+down_revision: Union[str, None] = 'c52d8f6e1a94'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('device_rollups',
+    sa.Column('device_id', sa.String(), nullable=False),
+    sa.Column('resolution', sa.String(), nullable=False),
+    sa.Column('bucket', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('samples', sa.Integer(), nullable=False),
+    sa.Column('corrente_min', sa.Float(), nullable=False),
+    sa.Column('corrente_max', sa.Float(), nullable=False),
+    sa.Column('corrente_sum', sa.Float(), nullable=False),
+    sa.Column('tensao_sum', sa.Float(), nullable=False),
+    sa.Column('potencia_sum', sa.Float(), nullable=False),
+    sa.Column('energia_wh', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['device_id'], ['devices.id'], ),
+    sa.PrimaryKeyConstraint('device_id', 'resolution', 'bucket')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('device_rollups')
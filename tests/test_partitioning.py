@@ -0,0 +1,92 @@
+import json
+from collections import defaultdict
+from paho.mqtt.client import topic_matches_sub
+import pytest
+from app.utils import mqtt_client
+from app.utils.partitioning import DevicePartition, device_partition
+
+PROCESSES = 4
+
+
+class Message:
+    def __init__(self, topic: str, payload: bytes):
+        self.topic = topic
+        self.payload = payload
+        self.properties = None
+
+
+class FanOutBroker:
+    # Faz o papel do broker numa assinatura comum: entrega cada mensagem a
+    # todos os assinantes cujo filtro casa com o tópico.
+    def __init__(self):
+        self.subscribers = []
+
+    def subscribe(self, topic_filter, handler):
+        self.subscribers.append((topic_filter, handler))
+
+    def publish(self, topic: str, payload: bytes):
+        for topic_filter, handler in self.subscribers:
+            if topic_matches_sub(topic_filter, topic):
+                handler(Message(topic, payload))
+
+
+@pytest.fixture
+def ingest_processes(monkeypatch):
+    # Cada "processo" é o handler real com a própria partição configurada; o
+    # que ele entregaria ao gravador fica registrado por índice.
+    received = defaultdict(list)
+    current = {}
+    monkeypatch.setattr(mqtt_client, "ingest_enabled", True)
+    monkeypatch.setattr(mqtt_client.presence, "touch", lambda device_id: None)
+    monkeypatch.setattr(mqtt_client.recent_readings, "extend", lambda readings: None)
+    monkeypatch.setattr(
+        mqtt_client.ingest_writer,
+        "enqueue_many",
+        lambda readings: received[current["index"]].extend(r["device_id"] for r in readings),
+    )
+
+    def process(index):
+        def handler(msg):
+            current["index"] = index
+            device_partition.configure(index, PROCESSES)
+            mqtt_client.on_message_handler(msg)
+        return handler
+
+    yield [process(index) for index in range(PROCESSES)], received
+    device_partition.configure(0, 1)
+
+
+def test_each_device_goes_to_exactly_one_process(ingest_processes):
+    handlers, received = ingest_processes
+    broker = FanOutBroker()
+    for handler in handlers:
+        broker.subscribe(mqtt_client.data_topic(""), handler)
+
+    devices = [f"medidor-{index}" for index in range(200)]
+    for _ in range(3):
+        for device_id in devices:
+            payload = {"id": device_id, "corrente": 1.5, "tensao": 220.0}
+            broker.publish(f"iot/{device_id}/data", json.dumps(payload).encode())
+
+    owners = defaultdict(set)
+    for index, device_ids in received.items():
+        for device_id in device_ids:
+            owners[device_id].add(index)
+    assert set(owners) == set(devices)
+    assert all(len(indexes) == 1 for indexes in owners.values())
+    assert sum(len(device_ids) for device_ids in received.values()) == 3 * len(devices)
+    assert len(received) == PROCESSES
+
+
+def test_partition_is_stable_and_covers_every_device():
+    partitions = [DevicePartition(index, PROCESSES) for index in range(PROCESSES)]
+    for index in range(1000):
+        device_id = f"dispositivo-{index}"
+        assert sum(partition.owns(device_id) for partition in partitions) == 1
+
+
+def test_shared_partition_accepts_everything_but_owns_nothing_at_start():
+    partition = DevicePartition(2, PROCESSES)
+    partition.share()
+    assert partition.owns("qualquer")
+    assert not partition.knows_owned()